@@ -50,15 +50,21 @@ import pandas as pd
 from scipy.stats import stats
 import matplotlib.pyplot as plt
 from statsmodels.formula.api import ols
+from progresa import (CellIndex, balance_table, effect_surface, fit_absorb, fit_ols, load_progresa,
+                      match_att, randomization_did, run_binary_grid, wild_cluster_bootstrap)
 
 
 # In[42]:
 
-#Reading progresa csv file
-progresa_df = pd.read_csv('progresa_sample.csv')
+#Reading progresa csv file through the typed column cache
+#poor (pobre = 1) and progresa (basal = 1) are loaded as 0/1 flags
+progresa_df = load_progresa('progresa_sample.csv')
 
-#Created new df by removing year, folnum, village columns
-progresa_df_edited = progresa_df.drop(['year','folnum','village'],axis=1)
+#Indexing the poor x year x progresa cells once (row offsets, counts, sums, sums of squares)
+cells = CellIndex.build(progresa_df)
+
+#Created new df by removing year, folnum, village columns and the poor, progresa flags
+progresa_df_edited = progresa_df.drop(['year','folnum','village','poor','progresa'],axis=1)
 
 #Calculating mean and standard deviation and sorting by variable name
 pd.DataFrame(pd.merge(progresa_df_edited.mean().reset_index(name='Mean'), progresa_df_edited.std().reset_index(name='Std_dev'),on=['index'])).sort_values(by ='index')
@@ -73,31 +79,21 @@ pd.DataFrame(pd.merge(progresa_df_edited.mean().reset_index(name='Mean'), progre
 # In[154]:
 
 #Filtering 
-progresa_filtered = progresa_df[(progresa_df.poor=='pobre') & (progresa_df.year==97)] 
-
-#Created new df by removing year, folnum, village columns
-progresa_df_edited = progresa_filtered.drop(['year','folnum','village'],axis=1)
-
-#Calculating mean values for treatment and control set
-progresa_treatment_control = pd.DataFrame(pd.merge(progresa_df_edited[progresa_df_edited.progresa == 'basal'].mean().reset_index(name='Average value (Treatment villages)'), progresa_df_edited[progresa_df_edited.progresa == '0'].mean().reset_index(name='Average value (Control villages)'),on=['index']))
-
-#Creating empty lists to append t value, p value and statistical significancy
-t_value = []
-p_value = []
-stats_significant = []
-
-#Iterating over the df to calculate t, p value and statistical significancy
-for i in list(progresa_treatment_control['index']):
-          t_value.append(stats.ttest_ind(list(progresa_df_edited[progresa_df_edited.progresa == 'basal'][i]), list(progresa_df_edited[progresa_df_edited.progresa == '0'][i]), nan_policy='omit').statistic)
-          p_value.append(stats.ttest_ind(progresa_df_edited[progresa_df_edited.progresa == 'basal'][i], progresa_df_edited[progresa_df_edited.progresa == '0'][i], nan_policy='omit').pvalue)
-          if stats.ttest_ind(progresa_df_edited[progresa_df_edited.progresa == 'basal'][i], progresa_df_edited[progresa_df_edited.progresa == '0'][i], nan_policy='omit').pvalue < 0.05:
-                stats_significant.append('TRUE')
-          else: stats_significant.append('FALSE')
-        
-# Using the above ccreated list to create 3 columns as needed        
-progresa_treatment_control['Difference (Treat - Control)'] = t_value   
-progresa_treatment_control['p-value'] = p_value
-progresa_treatment_control['Statistically_Significant'] = stats_significant      
+progresa_filtered = progresa_df[(progresa_df.poor==1) & (progresa_df.year==97)] 
+
+#Covariates to compare: every column except year, folnum, village and the poor, progresa flags
+covariates = progresa_filtered.columns.drop(['year','folnum','village','poor','progresa'])
+
+#Calculating means, t value, p value and statistical significancy for all covariates in one pass
+balance = balance_table(progresa_filtered, covariates, group='progresa')
+
+progresa_treatment_control = pd.DataFrame({'index': balance['covariate'],
+                                           'Average value (Treatment villages)': balance['mean_treated'],
+                                           'Average value (Control villages)': balance['mean_control'],
+                                           'Difference (Treat - Control)': balance['t'],
+                                           'p-value': balance['p'],
+                                           'Statistically_Significant': np.where(balance['significant'], 'TRUE', 'FALSE')})
+
 progresa_treatment_control
 
 
@@ -138,13 +134,13 @@ plt.show()
 
 # In[176]:
 
-#Filtering data based on year, poor and treatment
-#Grouping by sc to calculate mean of enrollment for each year, poor and treated group only
-progresa_filtered_97 = progresa_df[(progresa_df.poor=='pobre') & (progresa_df.year==97) & (progresa_df.progresa=='basal')] 
-by_village_97 = progresa_filtered_97.groupby([progresa_filtered_97.village])['sc'].mean().reset_index(name='Avg_Enrollment_Rate_97')
+#Village x poor effect surface: enrollment means for both years and arms from one grouped pass
+village_effects = effect_surface(progresa_df, by=[('village', 'poor')])
 
-progresa_filtered_98 = progresa_df[(progresa_df.poor=='pobre') & (progresa_df.year==98) & (progresa_df.progresa=='basal')] 
-by_village_98 = progresa_filtered_98.groupby([progresa_filtered_98.village])['sc'].mean().reset_index(name='Avg_Enrollment_Rate_98')
+#Mean of enrollment for each year, poor and treated villages only
+treated_poor_villages = village_effects[(village_effects.poor==1) & (village_effects.treated==1)]
+by_village_97 = treated_poor_villages[['village', 'mean_treated_pre']].rename(columns={'mean_treated_pre': 'Avg_Enrollment_Rate_97'})
+by_village_98 = treated_poor_villages[['village', 'mean_treated_post']].rename(columns={'mean_treated_post': 'Avg_Enrollment_Rate_98'})
 
 #Plotting histograms
 fig = plt.figure()
@@ -183,20 +179,17 @@ print('pvalue : ', pvalue)
 
 # In[180]:
 
-#Filtering for year, poor and progresa
-progresa_filtered_98_treatment = progresa_df[(progresa_df.poor=='pobre') & (progresa_df.year==98) & (progresa_df.progresa=='basal')] 
-progresa_filtered_98_control = progresa_df[(progresa_df.poor=='pobre') & (progresa_df.year==98) & (progresa_df.progresa=='0')] 
-
-#Calculating average enrollment rate for treatment and control
-progresa_treatment_98_avg_sc= progresa_filtered_98_treatment.mean()['sc']
-progresa_control_98_avg_sc= progresa_filtered_98_control.mean()['sc']
+#Calculating average enrollment rate for treatment and control from the poor, 1998 cells
+progresa_treatment_98_avg_sc = cells.mean('sc', poor=1, year=98, progresa=1)
+progresa_control_98_avg_sc = cells.mean('sc', poor=1, year=98, progresa=0)
 
 print('Average enrollment rate among poor households in the Treatment villages  is :',progresa_treatment_98_avg_sc)
 print('Average enrollment rate among poor households in the Control villages  is :',progresa_control_98_avg_sc)
 
-#Performing t-test
-tvalue = stats.ttest_ind(progresa_filtered_98_treatment['sc'],progresa_filtered_98_control['sc'], nan_policy='omit').statistic
-pvalue = stats.ttest_ind(progresa_filtered_98_treatment['sc'],progresa_filtered_98_control['sc'], nan_policy='omit').pvalue
+#Performing t-test from the cell statistics
+ttest_98 = cells.ttest('sc', dict(poor=1, year=98, progresa=1), dict(poor=1, year=98, progresa=0))
+tvalue = ttest_98.statistic
+pvalue = ttest_98.pvalue
 
 print('t statistic : ', tvalue)
 print('pvalue : ', pvalue)
@@ -211,7 +204,7 @@ print('pvalue : ', pvalue)
 # In[182]:
 
 #Filtering based on poor and for year 98
-progresa_filtered_98_poor = progresa_df[(progresa_df.poor=='pobre') & (progresa_df.year==98)]
+progresa_filtered_98_poor = progresa_df[(progresa_df.poor==1) & (progresa_df.year==98)]
 
 #Linear model
 lm_fit= ols(formula='sc ~ progresa', data=progresa_filtered_98_poor).fit()
@@ -245,6 +238,19 @@ lm_fit2= ols(formula='sc ~ age + progresa + indig + dist_sec + sex + hohedu + we
 lm_fit2.summary()
 
 
+# In[184]:
+
+#Matching each treated child to its nearest control on the covariates that differ at baseline
+#(KD-tree nearest neighbours on Mahalanobis distance, and on the propensity score within a 0.2 SD caliper)
+matched_nn = match_att(progresa_filtered_98_poor, method='mahalanobis')
+matched_ps = match_att(progresa_filtered_98_poor, method='propensity', caliper=0.2)
+print('Matched ATT (nearest neighbour) : ', matched_nn.att)
+print('Matched ATT (propensity score) : ', matched_ps.att)
+
+#Standardized mean differences before and after matching
+matched_nn.balance[['covariate', 'smd', 'smd_matched', 'variance_ratio', 'variance_ratio_matched']]
+
+
 # 1. How do the controls affect the point estimate of treatment effect?
 # Adding the control variables hasnt affected the treatment effect. The coefficient of progresa variable hasnt changed much from (0.0388 to 0.0353) and also its p value is still statistically significant. Thus the treatment of providing subsidy to poor children has increased the enrollment rate. Some of the other control variables also have a statistically significant value thus having an affect on the treatment. We can also see that the intercept value has increased considerably.
 # 
@@ -261,20 +267,13 @@ lm_fit2.summary()
 
 # In[188]:
 
-#Filtering for year , poor and progresa
-progresa_filtered_97_treatment = progresa_df[(progresa_df.poor=='pobre') & (progresa_df.year==97) & (progresa_df.progresa=='basal')] 
-progresa_filtered_97_control = progresa_df[(progresa_df.poor=='pobre') & (progresa_df.year==97) & (progresa_df.progresa=='0')] 
-
-progresa_filtered_98_treatment = progresa_df[(progresa_df.poor=='pobre') & (progresa_df.year==98) & (progresa_df.progresa=='basal')] 
-progresa_filtered_98_control = progresa_df[(progresa_df.poor=='pobre') & (progresa_df.year==98) & (progresa_df.progresa=='0')] 
-
-#Calculating means
-mean_treatment_98 = progresa_filtered_98_treatment.mean()['sc']
-mean_treatment_97 = progresa_filtered_97_treatment.mean()['sc']
+#Calculating means of the poor cells for each year and treatment status
+mean_treatment_98 = cells.mean('sc', poor=1, year=98, progresa=1)
+mean_treatment_97 = cells.mean('sc', poor=1, year=97, progresa=1)
 diff_treatment = mean_treatment_98 - mean_treatment_97
 
-mean_control_98 = progresa_filtered_98_control.mean()['sc']
-mean_control_97 = progresa_filtered_97_control.mean()['sc']
+mean_control_98 = cells.mean('sc', poor=1, year=98, progresa=0)
+mean_control_97 = cells.mean('sc', poor=1, year=97, progresa=0)
 diff_control = mean_control_98 - mean_control_97
 
 print ('The average of enrollment rate in Treated villages in 97: ', mean_treatment_98)
@@ -292,6 +291,10 @@ print('\n')
 diff = diff_treatment - diff_control
 print ('The difference of difference in the average enrollment rate is: ', diff)
 
+#The same difference of differences within age band, sex and indigenous subgroups of the poor
+subgroup_effects = effect_surface(progresa_df[progresa_df.poor==1], by=['age_band', 'sex', 'indig'])
+print(subgroup_effects[['dimension', 'age_band', 'sex', 'indig', 'effect', 'se']])
+
 
 # 1. As described above, I have implemented the difference in difference framework according to which the difference between the differences of the treated and control villages for year 98 and 97 gives the estimate. Thus the estimate is 0.0313.
 # This estimate is lesser than the estimate we got through simple linear regression 0.388 and multiple linear regression 0.0353.
@@ -304,13 +307,10 @@ print ('The difference of difference in the average enrollment rate is: ', diff)
 
 # In[207]:
 
-#Converting poor to a  binary variable form
-progresa_df.loc[progresa_df['poor'] == 'pobre', 'poor'] = 1
-progresa_df.loc[progresa_df['poor'] ==  'no pobre', 'poor'] = 0
+#poor is already a binary variable (pobre = 1) from the loader
 
 #Creating a binary variable for time
-progresa_df.loc[progresa_df.year == 97, 'time'] = 0
-progresa_df.loc[progresa_df.year == 98, 'time'] = 1
+progresa_df['time'] = (progresa_df.year == 98).astype('int8')
 
 #Filtering for poor group
 progresa_df_poor = progresa_df[(progresa_df.poor==1)]
@@ -322,6 +322,32 @@ lm_fit3 = ols(formula='sc ~ progresa + time + progresa*time + age + indig + dist
 lm_fit3.summary()
 
 
+# In[ ]:
+
+#Progresa was assigned by village: village-clustered standard errors
+lm_fit3_clustered = fit_ols('sc ~ progresa + time + progresa*time + age + indig + dist_sec + sex + hohedu', progresa_df_poor, cluster='village')
+print(lm_fit3_clustered.summary_frame())
+
+#Wild cluster bootstrap p-value of the progresa:time coefficient (n_jobs=1: this script has no __main__ guard, so no process pool)
+boot_fit3 = wild_cluster_bootstrap('sc ~ progresa + time + progresa*time + age + indig + dist_sec + sex + hohedu', progresa_df_poor, param='progresa:time', cluster='village', reps=9999, seed=0, n_jobs=1)
+print('Wild cluster bootstrap pvalue (progresa:time) : ', boot_fit3.pvalue)
+
+#Randomization inference: permuting progresa across villages for the tabular and regression estimates (in-process, as above)
+ri_tabular = randomization_did(progresa_df_poor, kind='tabular', reps=9999, seed=0, n_jobs=1)
+ri_regression = randomization_did(progresa_df_poor, kind='regression', controls=['age', 'indig', 'dist_sec', 'sex', 'hohedu'], reps=9999, seed=0, n_jobs=1)
+print('Randomization inference pvalue (tabular DiD) : ', ri_tabular.pvalue)
+print('Randomization inference pvalue (regression DiD) : ', ri_regression.pvalue)
+
+#Village fixed effects absorb the baseline imbalance in dist_sec, min_dist and the other village-level covariates
+lm_fit3_fe = fit_absorb('sc ~ progresa + time + progresa*time + age + indig + dist_sec + sex + hohedu', progresa_df_poor, absorb='village', cluster='village')
+print(lm_fit3_fe.summary_frame())
+
+#sc is binary: logit and probit versions, whose average marginal effects compare with the OLS coefficients
+#(for progresa:time the average double difference in enrollment probability)
+binary_fits = pd.concat([run_binary_grid(progresa_df_poor, {'did': 'sc ~ progresa + time + progresa*time + age + indig + dist_sec + sex + hohedu'}, link=link, cluster='village').assign(link=link) for link in ('logit', 'probit')])
+print(binary_fits[binary_fits.term == 'progresa:time'][['link', 'coef', 'ame', 'ame_se', 'pvalue']])
+
+
 # 1. What is your estimate of the impact of Progresa? Be very specific in interpreting your coefficients and standard errors, and make sure to specify exactly what units you are measuring and estimating.
 # We firstly create a binary variable for year, which is necssary according to difference in difference approach, control variable has to be binary. Next, we take into consideration the interaction between the treatment term and the year. 
 # Interpretting "progresa:time" interaction coefficient: For families in year 1998 being subjected to the progresa subsidy program, the average enrollment rates would be 0.0314 higher.
@@ -352,6 +378,10 @@ lm_fit4 = ols(formula = 'sc ~ progresa + poor + progresa*poor + sex + dist_sec
 #Summary
 lm_fit4.summary()
 
+#Village-clustered standard errors
+lm_fit4_clustered = fit_ols('sc ~ progresa + poor + progresa*poor + sex + dist_sec  + min_dist + dist_cap + hohedu + age', progresa_df_filtered_98, cluster='village')
+print(lm_fit4_clustered.summary_frame())
+
 
 # 1. How would we estimate this version of the treatment effects in a regression model? 
 # We firstly create a binary variable for poor or non-poor, which is necssary according to difference in difference approach, control variable has to be binary. Then adding a interaction term between progresa and poor, we get below resuls: 
@@ -380,6 +410,13 @@ lm_fit5 = ols(formula = 'sc ~ progresa + time + progresa*time + sex + dist_sec
 #Summary of the model
 lm_fit5.summary()
 
+#Village-clustered standard errors and wild cluster bootstrap p-value of progresa:time
+lm_fit5_clustered = fit_ols('sc ~ progresa + time + progresa*time + sex + dist_sec  + min_dist + dist_cap + hohedu + age + hohage', progresa_filtered_nonpoor, cluster='village')
+print(lm_fit5_clustered.summary_frame())
+
+boot_fit5 = wild_cluster_bootstrap('sc ~ progresa + time + progresa*time + sex + dist_sec  + min_dist + dist_cap + hohedu + age + hohage', progresa_filtered_nonpoor, param='progresa:time', cluster='village', reps=9999, seed=0, n_jobs=1)
+print('Wild cluster bootstrap pvalue (progresa:time) : ', boot_fit5.pvalue)
+
 
 # A: As PROGRESA was initiated to enroll more poor kids into education, I can think of only corruptive practices which might have led to non-poor kids to be benefited. If not for corruuptive practices, I think Progresa might have impacted non-poor households by inducing a thinking of since many children are studying, we should also send our kids.
 # 
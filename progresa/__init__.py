@@ -0,0 +1,46 @@
+"""Reusable building blocks for the Progresa (Mexico) econometric analysis.
+
+Names are imported lazily: ``import progresa`` costs nothing until an
+attribute is used, so the command-line entry point starts without loading
+pandas, scipy or Patsy.
+"""
+
+import importlib
+
+_EXPORTS = {
+    'SCHEMA': 'progresa.io',
+    'build_cache': 'progresa.io',
+    'load_progresa': 'progresa.io',
+    'read_csv_chunks': 'progresa.io',
+    'CellIndex': 'progresa.cells',
+    'balance_table': 'progresa.balance',
+    'OLSResults': 'progresa.ols',
+    'fit_streaming': 'progresa.streaming',
+    'cluster_cov': 'progresa.inference',
+    'fit_ols': 'progresa.inference',
+    'wild_cluster_bootstrap': 'progresa.inference',
+    'randomization_did': 'progresa.randomization',
+    'run_grid': 'progresa.grid',
+    'ResultCache': 'progresa.cache',
+    'fingerprint': 'progresa.cache',
+    'fit_absorb': 'progresa.fixed_effects',
+    'match_att': 'progresa.matching',
+    'effect_surface': 'progresa.heterogeneity',
+    'run_binary_grid': 'progresa.binary',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    try:
+        module = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,5 @@
+import sys
+
+from progresa.pipeline import main
+
+sys.exit(main())
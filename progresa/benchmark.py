@@ -0,0 +1,130 @@
+"""Scaling benchmarks for every analysis stage on synthetic panels.
+
+``run_benchmarks`` writes a synthetic CSV at the requested scale, then
+times and memory-profiles: parsing the raw CSV, building and memory-mapping
+the column cache, and every pipeline stage (summary table, balance table,
+village groupby and t-tests in ``graphics``, the cell-index differences
+and each regression). The whole sequence runs ``repeat`` times, stages
+interleaved, and the wall time is each stage's median over those passes,
+so a burst of machine load spreads over all stages instead of landing on
+one of them. Memory is the ``tracemalloc`` peak above the stage's starting
+point, taken in one more pass so tracing overhead never reaches the
+timings.
+
+Results can be saved as a JSON baseline and later runs compared against
+it; stages slower (relative to the run's overall speed) or hungrier than
+the baseline by more than a tolerance, and by more than an absolute floor
+so millisecond stages do not flag on noise, are flagged as regressions.
+"""
+
+import importlib
+import json
+import os
+import time
+import tracemalloc
+
+import pandas as pd
+
+from progresa import io, pipeline, synthetic
+
+# Imported up front so that one-off import costs are not charged to the
+# first stage that happens to use them.
+WARM_IMPORTS = ['progresa.cells', 'progresa.balance', 'progresa.inference',
+                'matplotlib.figure', 'matplotlib.backends.backend_agg']
+
+
+def _timed(func):
+    start = time.perf_counter()
+    value = func()
+    return value, time.perf_counter() - start
+
+
+def _traced(func):
+    tracemalloc.start()
+    try:
+        value = func()
+        return value, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(scale=1.0, seed=0, workdir='bench', repeat=5, stages=None):
+    """Benchmark the pipeline on a synthetic panel; return a tidy table.
+
+    Columns: ``stage``, ``seconds``, ``peak_bytes``, ``rows``.
+    """
+    for module in WARM_IMPORTS:
+        importlib.import_module(module)
+    os.makedirs(workdir, exist_ok=True)
+    csv = os.path.join(workdir, 'progresa_synthetic_x%g_s%d.csv' % (scale, seed))
+    if not os.path.exists(csv):
+        synthetic.write_csv(csv, scale=scale, seed=seed)
+    cache_dir = os.path.join(workdir, 'column_cache_x%g_s%d' % (scale, seed))
+    config = {'csv': csv, 'out': os.path.join(workdir, 'out'), 'data_cache': cache_dir}
+    order = pipeline.resolve(stages or list(pipeline.STAGES))
+
+    def one_pass(measure):
+        """Run every step once; return ``{step: measurement}`` and the rows."""
+        out = {}
+        raw, out['read_csv'] = measure(lambda: pd.read_csv(csv))
+        nrows = len(raw)
+        del raw
+        out['build_cache'] = measure(lambda: io.build_cache(csv, cache_dir))[1]
+        results = {}
+        for name in order:
+            s = pipeline.STAGES[name]
+            inputs = {dep: results[dep] for dep in s.inputs}
+            results[name], out[name] = measure(lambda: s.func(config, **inputs))
+        return out, nrows
+
+    timings = pd.DataFrame([one_pass(_timed)[0] for _ in range(max(repeat, 1))])
+    peaks, nrows = one_pass(_traced)
+    return pd.DataFrame({'stage': list(timings.columns),
+                         'seconds': timings.median().to_numpy(),
+                         'peak_bytes': [peaks[name] for name in timings.columns],
+                         'rows': nrows})
+
+
+def save_baseline(table, path, scale, seed):
+    with open(path, 'w') as f:
+        json.dump({'scale': scale, 'seed': seed,
+                   'stages': table.set_index('stage').to_dict(orient='index')},
+                  f, indent=1)
+
+
+def compare(table, path, scale=None, seed=None, tolerance=0.25, min_seconds=0.01,
+            min_bytes=1 << 20, normalize=True):
+    """Join ``table`` with a saved baseline and flag regressions.
+
+    A stage regresses when its time or peak memory exceeds the baseline by
+    more than ``tolerance`` (a fraction) and by more than ``min_seconds``
+    or ``min_bytes`` respectively. ``scale`` and ``seed`` must match the
+    baseline's when given; timings of different panels are not comparable.
+
+    On shared machines every stage of a run tends to be slower or faster
+    together, by tens of percent. With ``normalize`` the times are first
+    divided by the run's ``speed``, the median time ratio of the stages
+    above ``min_seconds``, so a stage is flagged for slowing down relative
+    to the others; a uniform slowdown shows in ``speed`` but is not flagged.
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    for name, value in [('scale', scale), ('seed', seed)]:
+        if value is not None and baseline.get(name) != value:
+            raise ValueError('baseline %s was run with %s=%r, not %r'
+                             % (path, name, baseline.get(name), value))
+    base = pd.DataFrame.from_dict(baseline['stages'], orient='index')
+    base.index.name = 'stage'
+    out = table.set_index('stage').join(base[['seconds', 'peak_bytes']],
+                                        rsuffix='_baseline')
+    out['time_ratio'] = out['seconds'] / out['seconds_baseline']
+    steady = out['seconds_baseline'] > min_seconds
+    speed = out.loc[steady, 'time_ratio'].median() if normalize and steady.any() else 1.0
+    out['speed'] = speed
+    out['memory_ratio'] = out['peak_bytes'] / out['peak_bytes_baseline']
+    slower = ((out['time_ratio'] / speed > 1 + tolerance)
+              & (out['seconds'] / speed - out['seconds_baseline'] > min_seconds))
+    hungrier = ((out['memory_ratio'] > 1 + tolerance)
+                & (out['peak_bytes'] - out['peak_bytes_baseline'] > min_bytes))
+    out['regression'] = slower | hungrier
+    return out.reset_index()
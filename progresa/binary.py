@@ -0,0 +1,351 @@
+"""Logit and probit models of the binary enrollment outcome, fitted in batches.
+
+``sc`` is 0/1 and every notebook model is a linear probability model.
+``run_binary_grid`` fits the same specifications as logit or probit
+models. It reuses ``progresa.grid.plan``: the union design is parsed once
+and every (specification, subsample) fit takes its columns and rows from
+it. That design can be stored as float32 to halve its memory; products
+are still accumulated in float64, block by block.
+
+Fits on one subsample run as a chain. Specifications are ordered by size
+and each one starts Newton's method from the coefficients of the fitted
+specification sharing most of its columns, so a model with one more
+control typically converges in a couple of iterations. Chains for
+different subsamples run on a thread pool.
+
+Each fit reports coefficients with iid or village-clustered standard
+errors and average marginal effects (AMEs) on the probability scale,
+comparable with the OLS coefficients. A 0/1 variable's AME is the mean
+change in probability from 0 to 1. A continuous variable's AME is the mean
+derivative. An interaction of two 0/1 variables (``progresa:time``)
+gets the mean double difference, the counterpart of the OLS DiD
+coefficient.
+"""
+
+import collections
+import concurrent.futures
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import special, stats
+
+from progresa import instrument
+from progresa.grid import plan
+from progresa.inference import cluster_cov
+from progresa.ols import solve_normal
+
+NewtonResult = collections.namedtuple(
+    'NewtonResult', ['params', 'cov', 'scores', 'llf', 'iterations', 'converged'])
+
+LINKS = ('logit', 'probit')
+
+
+def _cdf(link, eta):
+    return special.expit(eta) if link == 'logit' else special.ndtr(eta)
+
+
+def _pdf(link, eta):
+    if link == 'logit':
+        p = special.expit(eta)
+        return p * (1.0 - p)
+    return np.exp(-0.5 * eta * eta) / np.sqrt(2.0 * np.pi)
+
+
+def _pdf_slope(link, eta):
+    """Derivative of the density with respect to the index."""
+    if link == 'logit':
+        p = special.expit(eta)
+        return p * (1.0 - p) * (1.0 - 2.0 * p)
+    return -eta * _pdf(link, eta)
+
+
+def _terms(link, eta, y):
+    """Log-likelihood, score weights and Hessian weights at ``eta``.
+
+    The score is ``X' g`` and the negative Hessian ``X' diag(w) X``
+    (the observed Hessian, as ``statsmodels`` uses for both links).
+    """
+    q = 2.0 * y - 1.0
+    z = q * eta
+    if link == 'logit':
+        llf = -np.logaddexp(0.0, -z).sum()
+        g = q * special.expit(-z)
+        w = special.expit(z) * special.expit(-z)
+    else:
+        log_cdf = special.log_ndtr(z)
+        ratio = np.exp(-0.5 * z * z - 0.5 * np.log(2.0 * np.pi) - log_cdf)
+        llf = log_cdf.sum()
+        g = q * ratio
+        w = ratio * (ratio + z)
+    return llf, g, w
+
+
+def _weighted_gram(X, w, block):
+    """``X' diag(w) X`` in float64, ``block`` rows at a time."""
+    k = X.shape[1]
+    out = np.zeros((k, k))
+    for start in range(0, len(X), block):
+        Xb = np.asarray(X[start:start + block], dtype=np.float64)
+        out += (Xb * w[start:start + block, None]).T @ Xb
+    return out
+
+
+def _dot(X, beta, block):
+    out = np.empty(len(X))
+    for start in range(0, len(X), block):
+        out[start:start + block] = np.asarray(X[start:start + block],
+                                              dtype=np.float64) @ beta
+    return out
+
+
+def _tdot(X, g, block):
+    out = np.zeros(X.shape[1])
+    for start in range(0, len(X), block):
+        out += g[start:start + block] @ np.asarray(X[start:start + block],
+                                                   dtype=np.float64)
+    return out
+
+
+def newton_binary(X, y, link='logit', start=None, tol=1e-8, maxiter=100,
+                  block=1 << 16):
+    """Maximum likelihood logit or probit by Newton's method.
+
+    ``X`` may be float32; every product is accumulated in float64 over
+    ``block`` rows. Steps are halved while they lower the likelihood, so a
+    poor ``start`` cannot make the iteration diverge. Returns a
+    ``NewtonResult``; ``cov`` is the inverse of the negative Hessian and
+    ``scores`` the per-row score weights (score = ``X' scores``).
+    """
+    if link not in LINKS:
+        raise ValueError('link must be one of %s, not %r' % (', '.join(LINKS), link))
+    y = np.asarray(y, dtype=np.float64)
+    beta = np.zeros(X.shape[1]) if start is None else np.array(start, dtype=np.float64)
+    llf, g, w = _terms(link, _dot(X, beta, block), y)
+    converged = False
+    for iteration in range(1, maxiter + 1):
+        step, _ = solve_normal(_weighted_gram(X, w, block), _tdot(X, g, block))
+        for _ in range(30):
+            trial = _terms(link, _dot(X, beta + step, block), y)
+            if trial[0] >= llf - 1e-12 * abs(llf):
+                break
+            step = step / 2.0
+        beta = beta + step
+        change = llf - trial[0]
+        llf, g, w = trial
+        if np.max(np.abs(step)) < tol or abs(change) < 1e-14 * abs(llf):
+            converged = True
+            break
+    _, cov = solve_normal(_weighted_gram(X, w, block), np.zeros(X.shape[1]))
+    return NewtonResult(beta, cov, g, llf, iteration, converged)
+
+
+def _null_llf(link, y):
+    p = y.mean()
+    if p <= 0.0 or p >= 1.0:
+        return 0.0
+    return len(y) * (p * np.log(p) + (1.0 - p) * np.log(1.0 - p))
+
+
+def _cold_start(link, names, y):
+    start = np.zeros(len(names))
+    if 'Intercept' in names:
+        p = np.clip(y.mean(), 1e-6, 1.0 - 1e-6)
+        start[names.index('Intercept')] = (special.logit(p) if link == 'logit'
+                                           else special.ndtri(p))
+    return start
+
+
+def _factor_values(data, rows, code, cache):
+    if code not in cache:
+        cache[code] = (data[code].to_numpy(dtype=np.float64)[rows]
+                       if code in data.columns else None)
+    return cache[code]
+
+
+def _marginal_effects(link, X, beta, cov, terms, data, rows, block):
+    """AME and delta-method standard error for every term of one fit.
+
+    ``terms`` lists ``(term, columns)`` in design order. Factors that are
+    not plain data columns (``C(...)``, ``I(...)``) get no AME and are
+    treated as separate variables by the others.
+    """
+    cache = {}
+    factors = [[f.code for f in term.factors] for term, _ in terms]
+    eta = _dot(X, beta, block)
+
+    def column(t, assign):
+        # Term ``t`` recomputed with some factors fixed.
+        value = np.ones(len(rows))
+        for code in factors[t]:
+            if code in assign:
+                value = value * assign[code]
+            else:
+                values = _factor_values(data, rows, code, cache)
+                if values is None:
+                    return None
+                value = value * values
+        return value
+
+    def scenario(assign):
+        """Index and design with the assigned factors fixed."""
+        index = eta.copy()
+        changed = {}
+        for t, (_, cols) in enumerate(terms):
+            if len(cols) == 1 and any(code in assign for code in factors[t]):
+                value = column(t, assign)
+                if value is None:
+                    return None
+                j = cols[0]
+                index += beta[j] * (value - X[:, j])
+                changed[j] = value
+        return index, changed
+
+    def mean_gradient(weights, changed):
+        """``mean(weights * X_s)`` with the scenario's changed columns."""
+        grad = _tdot(X, weights, block) / len(weights)
+        for j, value in changed.items():
+            grad[j] = weights @ value / len(weights)
+        return grad
+
+    def binary(code):
+        values = _factor_values(data, rows, code, cache)
+        return values is not None and np.isin(values, (0.0, 1.0)).all()
+
+    ame = np.full(len(terms), np.nan)
+    ame_se = np.full(len(terms), np.nan)
+    for t, (term, cols) in enumerate(terms):
+        codes = factors[t]
+        if len(cols) != 1 or not codes or len(set(codes)) != len(codes):
+            continue
+        if all(binary(code) for code in codes) and len(codes) <= 2:
+            # Discrete change (one factor) or double difference (two).
+            value, grad = 0.0, np.zeros(len(beta))
+            for levels in np.ndindex(*(2,) * len(codes)):
+                sign = (-1) ** (len(codes) - sum(levels))
+                fixed = scenario(dict(zip(codes, levels)))
+                if fixed is None:
+                    break
+                index, changed = fixed
+                value += sign * _cdf(link, index).mean()
+                grad += sign * mean_gradient(_pdf(link, index), changed)
+            else:
+                ame[t] = value
+                ame_se[t] = np.sqrt(grad @ cov @ grad)
+        elif len(codes) == 1:
+            # Mean derivative, through every term containing the variable.
+            code = codes[0]
+            slope = np.zeros(len(rows))
+            partial = {}
+            for u, (_, ucols) in enumerate(terms):
+                if len(ucols) == 1 and code in factors[u]:
+                    others = column(u, {code: 1.0})
+                    if others is None:
+                        break
+                    slope += beta[ucols[0]] * others
+                    partial[ucols[0]] = others
+            else:
+                density = _pdf(link, eta)
+                ame[t] = (density * slope).mean()
+                grad = mean_gradient(_pdf_slope(link, eta) * slope, {})
+                for j, others in partial.items():
+                    grad[j] += (density * others).mean()
+                ame_se[t] = np.sqrt(grad @ cov @ grad)
+    return ame, ame_se
+
+
+def run_binary_grid(data, specs, subsets=None, link='logit', cluster=None,
+                    dtype=np.float64, tol=1e-8, maxiter=100, block=1 << 16,
+                    n_jobs=None):
+    """Fit every specification on every subsample as a logit or probit.
+
+    Parameters
+    ----------
+    specs, subsets
+        As for ``run_grid``; outcomes must be 0/1.
+    link : {'logit', 'probit'}
+    cluster : str, optional
+        Column for cluster-robust errors (e.g. ``'village'``), CR1 as in
+        ``statsmodels`` ``cov_type='cluster'``.
+    dtype : numpy dtype
+        Storage of the shared design; ``np.float32`` halves its memory.
+    n_jobs : int, optional
+        Threads; each runs the warm-started chain of one subsample.
+
+    Returns a tidy DataFrame with one row per (spec, subset, term): ``coef``,
+    ``std_err``, ``z``, ``pvalue`` (normal), ``ame``, ``ame_se``, ``nobs``,
+    ``llf``, McFadden's ``pseudo_rsquared``, ``iterations`` and
+    ``converged``.
+    """
+    full, slices, jobs, masks = plan(data, specs, subsets)
+    Z = full.to_numpy(dtype=dtype)
+    columns = list(full.columns)
+    term_at = {slices[term].start: term for term in slices}
+    groups = data[cluster].to_numpy() if cluster else None
+
+    def fit_chain(chain):
+        chain = sorted(chain, key=lambda job: len(job[2]))
+        fitted = []
+        out = []
+        for spec, subset, xcols, ycol, s in chain:
+            rows = np.flatnonzero(masks[:, s])
+            if not len(rows):
+                continue
+            names = [columns[j] for j in xcols]
+            X = Z[np.ix_(rows, xcols)]
+            y = Z[rows, ycol].astype(np.float64)
+            if not np.isin(y, (0.0, 1.0)).all():
+                raise ValueError('spec %r outcome is not 0/1' % spec)
+            # Warm start from the fit sharing the most columns.
+            start = _cold_start(link, names, y)
+            if fitted:
+                prev_cols, prev_params = max(
+                    fitted, key=lambda f: len(np.intersect1d(f[0], xcols)))
+                shared = {c: b for c, b in zip(prev_cols, prev_params)}
+                start = np.array([shared.get(c, b) for c, b in zip(xcols, start)])
+            with instrument.span('newton', 'binary', rows=len(rows)):
+                res = newton_binary(X, y, link, start=start, tol=tol,
+                                    maxiter=maxiter, block=block)
+            fitted.append((xcols, res.params))
+            cov = res.cov
+            if cluster:
+                cov, _ = cluster_cov(np.asarray(X, dtype=np.float64), res.scores,
+                                     groups[rows], res.cov)
+            terms = []
+            for j in xcols:
+                if j in term_at:
+                    term = term_at[j]
+                    terms.append((term, [c for c, col in enumerate(xcols)
+                                         if slices[term].start <= col < slices[term].stop]))
+            ame = np.full(len(xcols), np.nan)
+            ame_se = np.full(len(xcols), np.nan)
+            term_ame, term_se = _marginal_effects(link, X, res.params, cov, terms,
+                                                  data, rows, block)
+            for (_, cols), a, se in zip(terms, term_ame, term_se):
+                if len(cols) == 1:
+                    ame[cols[0]], ame_se[cols[0]] = a, se
+            k = len(names)
+            null = _null_llf(link, y)
+            out.append((np.repeat(spec, k), np.repeat(subset, k), np.array(names, dtype=object),
+                        res.params, np.sqrt(np.diag(cov)), ame, ame_se,
+                        np.full(k, len(rows)), np.full(k, res.llf),
+                        np.full(k, 1.0 - res.llf / null if null else np.nan),
+                        np.full(k, res.iterations), np.full(k, res.converged)))
+        return out
+
+    chains = collections.OrderedDict()
+    for job in jobs:
+        chains.setdefault(job[1], []).append(job)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count() or 1) as pool:
+        fits = [fit for chain in pool.map(fit_chain, chains.values()) for fit in chain]
+    if not fits:
+        raise ValueError('no specification has any complete observations')
+
+    (spec, subset, term, coef, se, ame, ame_se, nobs, llf, pseudo, iterations,
+     converged) = [np.concatenate(part) for part in zip(*fits)]
+    z = coef / se
+    return pd.DataFrame({
+        'spec': spec, 'subset': subset, 'term': term, 'coef': coef, 'std_err': se,
+        'z': z, 'pvalue': 2.0 * stats.norm.sf(np.abs(z)), 'ame': ame,
+        'ame_se': ame_se, 'nobs': nobs, 'llf': llf, 'pseudo_rsquared': pseudo,
+        'iterations': iterations, 'converged': converged})
@@ -0,0 +1,159 @@
+"""Content-addressed on-disk cache for analysis stage results.
+
+A result is stored under the SHA-256 of its stage name, a fingerprint of
+the input data and the stage parameters (formula, subset predicate, test
+options, ...). Changing one regression therefore changes only that
+regression's key, and re-running recomputes just that stage. The cache
+directory is bounded in size and evicts least-recently-used entries.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+def fingerprint(data):
+    """SHA-256 of a DataFrame's columns, dtypes and values (index included)."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[str(c), str(t)] for c, t in data.dtypes.items()]).encode())
+    digest.update(np.ascontiguousarray(
+        pd.util.hash_pandas_object(data, index=True).to_numpy()).tobytes())
+    return digest.hexdigest()
+
+
+def _canonical(params):
+    return json.dumps(params, sort_keys=True, default=repr)
+
+
+class ResultCache(object):
+    """Pickled stage results keyed by (stage, data fingerprint, params).
+
+    Parameters
+    ----------
+    directory : str
+        Where entries live; created on first use.
+    max_bytes : int
+        Size bound of the directory. After every write the least recently
+        used entries (by modification time, refreshed on every hit) are
+        deleted until the total fits.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._hits = collections.Counter()
+        self._misses = collections.Counter()
+        self._lock = threading.Lock()
+
+    def key(self, stage, data_fingerprint, params=None):
+        payload = _canonical([stage, data_fingerprint, params or {}])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def get(self, key):
+        """Return ``(True, value)`` on a hit, ``(False, None)`` on a miss.
+
+        An entry that cannot be unpickled (truncated, or written by code
+        whose classes have since moved or changed) counts as a miss and is
+        deleted.
+        """
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return False, None
+        with f:
+            try:
+                value = pickle.load(f)
+                loaded = True
+            except Exception:
+                loaded = False
+        if not loaded:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return False, None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True, value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self.evict()
+
+    def get_or_compute(self, stage, compute, data=None, data_fingerprint=None,
+                       params=None):
+        """Return the cached result of ``compute()`` for this stage.
+
+        The data are identified by ``data_fingerprint`` when given (pass it
+        to avoid re-hashing a large frame for every stage), otherwise by
+        ``fingerprint(data)``.
+        """
+        if data_fingerprint is None and data is not None:
+            data_fingerprint = fingerprint(data)
+        key = self.key(stage, data_fingerprint, params)
+        hit, value = self.get(key)
+        with self._lock:
+            (self._hits if hit else self._misses)[stage] += 1
+        if hit:
+            return value
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith('.pkl'):
+                    st = entry.stat()
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Delete least-recently-used entries until the cache fits."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            os.remove(path)
+
+    def stats(self):
+        """Hit and miss counts per stage for this process."""
+        stages = sorted(set(self._hits) | set(self._misses))
+        return pd.DataFrame({'stage': stages,
+                             'hits': [self._hits[s] for s in stages],
+                             'misses': [self._misses[s] for s in stages]},
+                            columns=['stage', 'hits', 'misses'])
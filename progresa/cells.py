@@ -0,0 +1,127 @@
+"""One-pass cell index over the poor x year x treatment design.
+
+The notebook answers every descriptive question (cell means, simple
+differences, the tabular difference-in-differences) by boolean-masking the
+full frame again. ``CellIndex`` scans the data once, storing for each cell
+the row offsets plus NaN-omitting count, sum and sum of squares of every
+numeric column, so those questions are answered in O(cells).
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from progresa import instrument
+from progresa.kernels import factorize, group_moments
+
+CELL_KEYS = ('poor', 'year', 'progresa')
+
+
+class CellIndex(object):
+    """Sufficient statistics and row offsets for every key combination."""
+
+    def __init__(self, keys, cells, columns, count, total, sumsq, shift,
+                 order, starts):
+        self.keys = tuple(keys)
+        self.cells = cells
+        self.columns = list(columns)
+        self._col = {name: j for j, name in enumerate(self.columns)}
+        self._count = count
+        self._total = total
+        self._sumsq = sumsq
+        self._shift = shift
+        self._order = order
+        self._starts = starts
+
+    @classmethod
+    def build(cls, data, keys=CELL_KEYS, columns=None):
+        """Index ``data`` by ``keys``; ``columns`` defaults to every other
+        numeric column."""
+        keys = tuple(keys)
+        if columns is None:
+            columns = [name for name in data.columns
+                       if name not in keys and pd.api.types.is_numeric_dtype(data[name])]
+        with instrument.span('groupby', 'cells', rows=len(data)):
+            codes, uniques = factorize(*[data[key].to_numpy() for key in keys])
+            ncells = len(uniques[0])
+            values = (np.column_stack([data[name].to_numpy(dtype=np.float64)
+                                       for name in columns])
+                      if columns else np.empty((len(data), 0)))
+            count, total, sumsq, shift = group_moments(codes, values, ncells)
+
+        order = np.argsort(codes, kind='stable')
+        starts = np.zeros(ncells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=ncells), out=starts[1:])
+        cells = pd.DataFrame(dict(zip(keys, uniques)))
+        return cls(keys, cells, columns, count, total, sumsq, shift, order, starts)
+
+    def _select(self, key):
+        unknown = set(key) - set(self.keys)
+        if unknown:
+            raise KeyError('not an index key: %s' % ', '.join(sorted(unknown)))
+        mask = np.ones(len(self.cells), dtype=bool)
+        for name, value in key.items():
+            mask &= self.cells[name].to_numpy() == value
+        return mask
+
+    def rows(self, **key):
+        """Row positions (for ``.iloc``) of every row matching ``key``."""
+        cells = np.flatnonzero(self._select(key))
+        return np.sort(np.concatenate(
+            [self._order[self._starts[c]:self._starts[c + 1]] for c in cells]
+            or [np.empty(0, dtype=np.intp)]))
+
+    def moments(self, column, **key):
+        """``(n, mean, var)`` of ``column`` pooled over the matching cells."""
+        j = self._col[column]
+        mask = self._select(key)
+        n = self._count[mask, j].sum()
+        s = self._total[mask, j].sum()
+        ss = self._sumsq[mask, j].sum()
+        mean = self._shift[j] + s / n if n else np.nan
+        var = (ss - s * s / n) / (n - 1) if n > 1 else np.nan
+        return n, mean, var
+
+    def count(self, column, **key):
+        return self.moments(column, **key)[0]
+
+    def mean(self, column, **key):
+        return self.moments(column, **key)[1]
+
+    def var(self, column, **key):
+        return self.moments(column, **key)[2]
+
+    def table(self, column):
+        """Tidy per-cell table of count, mean and variance of ``column``."""
+        j = self._col[column]
+        n = self._count[:, j]
+        s = self._total[:, j]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self._shift[j] + s / n
+            var = (self._sumsq[:, j] - s * s / n) / (n - 1)
+        out = self.cells.copy()
+        out['count'] = n
+        out['mean'] = mean
+        out['var'] = np.where(n > 1, var, np.nan)
+        return out
+
+    def ttest(self, column, a, b, equal_var=True):
+        """Two-sample t-test of ``column`` between cell selections ``a`` and
+        ``b`` (dicts of key values), with ``nan_policy='omit'`` semantics."""
+        n1, m1, v1 = self.moments(column, **a)
+        n2, m2, v2 = self.moments(column, **b)
+        return stats.ttest_ind_from_stats(m1, np.sqrt(v1), n1, m2, np.sqrt(v2), n2,
+                                          equal_var=equal_var)
+
+    def simple_difference(self, column='sc', treatment='progresa', **key):
+        """Treated minus control mean of ``column`` within ``key``."""
+        treated = dict(key, **{treatment: 1})
+        control = dict(key, **{treatment: 0})
+        return self.mean(column, **treated) - self.mean(column, **control)
+
+    def diff_in_diff(self, column='sc', treatment='progresa', time='year',
+                     pre=97, post=98, **key):
+        """Tabular difference-in-differences of ``column`` within ``key``."""
+        after = self.simple_difference(column, treatment, **dict(key, **{time: post}))
+        before = self.simple_difference(column, treatment, **dict(key, **{time: pre}))
+        return after - before
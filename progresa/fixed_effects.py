@@ -0,0 +1,137 @@
+"""Least squares with absorbed high-dimensional fixed effects.
+
+``fit_absorb`` takes the same formula as the ``ols`` calls and sweeps out
+child (``folnum``) and/or village effects with group demeaning instead of
+dummy columns. One effect is removed exactly in a single pass; several are
+removed by alternating projections (demean by each effect in turn until
+the data stop changing). Memory is linear in the number of rows.
+"""
+
+import numpy as np
+
+from progresa import instrument
+from progresa.design import build_design
+from progresa.inference import cluster_cov
+from progresa.kernels import factorize, group_sums
+from progresa.ols import OLSResults
+
+
+def _drop_singletons(codes):
+    """Mask of rows outside groups of size one, applied until stable."""
+    keep = np.ones(len(codes[0]), dtype=bool)
+    while True:
+        before = keep.sum()
+        for c in codes:
+            sizes = np.bincount(c[keep], minlength=c.max() + 1)
+            keep &= sizes[c] > 1
+        if keep.sum() == before:
+            return keep
+
+
+def demean(Z, codes, tol=1e-10, maxiter=1000):
+    """Project the columns of ``Z`` off one or more sets of group dummies.
+
+    Returns ``(Z_within, iterations)``. ``codes`` is a list of dense group
+    code arrays; the loop stops when a full sweep moves no entry by more
+    than ``tol`` times the column scale.
+    """
+    Z = np.array(Z, dtype=np.float64)
+    counts = [np.bincount(c) for c in codes]
+    scale = np.maximum(np.abs(Z).max(axis=0), 1.0)
+    for iteration in range(1, maxiter + 1):
+        change = 0.0
+        for c, n in zip(codes, counts):
+            means = group_sums(c, Z, len(n)) / n[:, None]
+            Z -= means[c]
+            change = max(change, np.max(np.abs(means) / scale)) if len(means) else change
+        if len(codes) == 1 or change < tol:
+            return Z, iteration
+    raise RuntimeError('fixed-effect demeaning did not converge in %d sweeps'
+                       % maxiter)
+
+
+def fit_absorb(formula, data, absorb, subset=None, cluster=None,
+               drop_singletons=True, tol=1e-10, maxiter=1000):
+    """OLS of ``formula`` with the effects in ``absorb`` swept out.
+
+    Parameters
+    ----------
+    absorb : str or list of str
+        Columns whose levels get fixed effects, e.g. ``'village'`` or
+        ``['folnum', 'village']``.
+    cluster : str, optional
+        Column for cluster-robust errors (e.g. ``'village'``).
+    drop_singletons : bool
+        Drop observations alone in their group; they are fitted perfectly
+        and only distort the degrees of freedom.
+
+    Regressors that are constant within an absorbed group (``progresa``
+    under village effects) are collinear with the effects and are dropped.
+    ``rsquared`` is the within R-squared. Absorbed effects count against
+    the residual degrees of freedom, except effects nested within the
+    clusters when ``cluster`` is given.
+    """
+    absorb = [absorb] if isinstance(absorb, str) else list(absorb)
+    extra = absorb + ([cluster] if cluster and cluster not in absorb else [])
+    design = build_design(formula, data, subset=subset, extra=extra)
+    keep_cols = [j for j, name in enumerate(design.names) if name != 'Intercept']
+    names = [design.names[j] for j in keep_cols]
+    Z = np.column_stack([design.y, design.X[:, keep_cols]])
+    codes = [factorize(design.extras[name])[0] for name in absorb]
+    groups = design.extras[cluster] if cluster else None
+
+    if drop_singletons:
+        keep = _drop_singletons(codes)
+        if not keep.all():
+            Z = Z[keep]
+            codes = [factorize(c[keep])[0] for c in codes]
+            groups = groups[keep] if cluster else None
+
+    with instrument.span('demean', 'fixed_effects', rows=len(Z)):
+        Zw, _ = demean(Z, codes, tol=tol, maxiter=maxiter)
+    y, X = Zw[:, 0], Zw[:, 1:]
+
+    # Drop regressors swept out by the effects.
+    norms = np.sqrt((X * X).sum(axis=0))
+    before = np.sqrt((Z[:, 1:] ** 2).sum(axis=0))
+    identified = norms > 1e-8 * np.maximum(before, 1.0)
+    X = X[:, identified]
+    names = [name for name, ok in zip(names, identified) if ok]
+
+    n = len(y)
+    k = np.linalg.matrix_rank(X.T @ X)
+    xtx_inv = np.linalg.pinv(X.T @ X, hermitian=True)
+    params = xtx_inv @ (X.T @ y)
+    resid = y - X @ params
+    ssr = resid @ resid
+
+    # Effects cost degrees of freedom unless they are redundant: nested in
+    # the clusters, or coarser than another absorbed effect (villages once
+    # children are absorbed). Each further dimension shares one level.
+    cluster_codes = factorize(groups)[0] if cluster else None
+    counted = []
+    for j, c in enumerate(codes):
+        if cluster and _nested(c, cluster_codes):
+            continue
+        if any(_nested(other, c) and (i < j or not _nested(c, other))
+               for i, other in enumerate(codes) if i != j):
+            continue
+        counted.append(c.max() + 1)
+    df_fe = sum(counted) - max(len(counted) - 1, 0)
+    df_resid = n - k - df_fe
+
+    if cluster:
+        cov, nclusters = cluster_cov(X, resid, groups, xtx_inv)
+        # cluster_cov assumes n - k residual df; account for the effects.
+        cov *= (n - X.shape[1]) / float(df_resid)
+        return OLSResults(names, params, cov, n, df_resid, ssr, y @ y,
+                          cov_type='cluster', df_model=k,
+                          df_inference=nclusters - 1)
+    return OLSResults(names, params, xtx_inv * (ssr / df_resid), n, df_resid,
+                      ssr, y @ y, df_model=k)
+
+
+def _nested(codes, cluster_codes):
+    """True when every group of ``codes`` lies inside a single cluster."""
+    pairs = np.unique(np.column_stack([codes, cluster_codes]), axis=0)
+    return len(pairs) == codes.max() + 1
@@ -0,0 +1,177 @@
+"""Specification grids that share one design matrix.
+
+The DiD and multiple regressions differ only in their control sets and
+subsamples. ``run_grid`` evaluates the union of every specification's
+terms once, then:
+
+* works out the distinct estimation samples: a subsample predicate
+  combined with the missing values of whichever of a specification's
+  columns have any (many specifications share one sample);
+* splits the rows into atoms, rows that belong to exactly the same set of
+  estimation samples;
+* computes one cross-product block Z'Z per atom, with Z the full column
+  set plus every outcome and a column of ones;
+* forms each estimation sample's cross-products by adding its atoms'
+  blocks, and solves every specification on its sub-block.
+
+Adding a control is a larger sub-block of the same matrix and adding a
+subsample adds atom blocks, so no specification re-parses a formula or
+rebuilds its design.
+"""
+
+import concurrent.futures
+import os
+
+import numpy as np
+import pandas as pd
+import patsy
+from scipy import stats
+
+from progresa.ols import solve_moments
+
+
+def _as_named(items, default_name):
+    if items is None:
+        return {default_name: None}
+    if isinstance(items, dict):
+        return dict(items)
+    return {item: item for item in items}
+
+
+def _union_design(data, descs):
+    """One Patsy design holding every outcome and right-hand-side term."""
+    terms = []
+    for desc in descs:
+        for term in desc.lhs_termlist + desc.rhs_termlist:
+            if term not in terms:
+                terms.append(term)
+    full = patsy.dmatrix(patsy.ModelDesc([], terms), data,
+                         NA_action=patsy.NAAction(NA_types=[]),
+                         return_type='dataframe')
+    return full, full.design_info.term_slices
+
+
+def _columns(slices, terms):
+    ordered = sorted(terms, key=lambda term: slices[term].start)
+    return np.concatenate([np.arange(slices[t].start, slices[t].stop)
+                           for t in ordered]) if ordered else np.empty(0, dtype=np.intp)
+
+
+def plan(data, specs, subsets=None):
+    """Union design, distinct estimation samples and one job per fit.
+
+    Returns ``(full, slices, jobs, masks)``: the union design as a
+    DataFrame (missing values kept), its term slices, a list of
+    ``(spec, subset, xcols, ycol, sample)`` tuples and the ``(n, samples)``
+    boolean membership matrix.
+    """
+    specs = _as_named(specs, None)
+    subsets = _as_named(subsets, 'all')
+    descs = {name: patsy.ModelDesc.from_formula(f) for name, f in specs.items()}
+    for name, desc in descs.items():
+        if len(desc.lhs_termlist) != 1:
+            raise ValueError('spec %r must have exactly one outcome' % name)
+
+    full, slices = _union_design(data, descs.values())
+    finite = np.isfinite(full.to_numpy(dtype=np.float64))
+    has_missing = ~finite.all(axis=0)
+
+    # Distinct estimation samples, keyed by subset and the spec's columns
+    # that contain missing values.
+    subset_masks = {name: np.ones(len(data), dtype=bool) if query is None
+                    else np.asarray(data.eval(query), dtype=bool)
+                    for name, query in subsets.items()}
+    samples = {}
+    jobs = []
+    for spec, desc in descs.items():
+        xcols = _columns(slices, desc.rhs_termlist)
+        ycol = _columns(slices, desc.lhs_termlist)
+        if len(ycol) != 1:
+            raise ValueError('spec %r outcome must be a single column' % spec)
+        cols = np.concatenate([xcols, ycol])
+        nan_cols = tuple(cols[has_missing[cols]])
+        for subset in subset_masks:
+            key = (subset, nan_cols)
+            if key not in samples:
+                samples[key] = len(samples)
+            jobs.append((spec, subset, xcols, ycol[0], samples[key]))
+    masks = np.zeros((len(data), len(samples)), dtype=bool)
+    for (subset, nan_cols), s in samples.items():
+        masks[:, s] = subset_masks[subset] & finite[:, list(nan_cols)].all(axis=1)
+    return full, slices, jobs, masks
+
+
+def run_grid(data, specs, subsets=None, n_jobs=None):
+    """Fit every specification on every subsample by OLS.
+
+    Parameters
+    ----------
+    specs : dict or list
+        ``{name: formula}``, or a list of formulas used as their own names.
+        Every formula must have a single outcome.
+    subsets : dict or list, optional
+        ``{name: query}`` of ``DataFrame.query`` predicates (``None`` for
+        all rows); defaults to the whole frame.
+    n_jobs : int, optional
+        Threads used for the cross-product blocks and the solves.
+
+    Rows with missing values in a specification's variables are dropped
+    for that specification only, as ``ols(...).fit()`` does. Columns are
+    coded once for the union model, so categorical terms are coded as in
+    a model with an intercept and all their main effects; categorical
+    variables must not be missing. Returns a tidy DataFrame with one row
+    per (spec, subset, term).
+    """
+    full, _, jobs, masks = plan(data, specs, subsets)
+    Z = np.column_stack([full.to_numpy(dtype=np.float64), np.ones(len(full))])
+    one = Z.shape[1] - 1
+    columns = np.asarray(full.columns, dtype=object)
+    nsamples = masks.shape[1]
+
+    # Atoms: rows sharing the same membership across all samples.
+    signatures, atom = np.unique(np.packbits(masks, axis=1), axis=0,
+                                 return_inverse=True)
+    atom = atom.ravel()
+    order = np.argsort(atom, kind='stable')
+    bounds = np.searchsorted(atom[order], np.arange(len(signatures) + 1))
+    in_atom = np.unpackbits(signatures, axis=1, count=nsamples).astype(bool)
+
+    def block(a):
+        rows = order[bounds[a]:bounds[a + 1]]
+        return Z[rows].T @ Z[rows] if in_atom[a].any() else None
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        blocks = list(pool.map(block, range(len(signatures))))
+
+        # Cross-products of each sample; entries of columns the sample
+        # does not use may be NaN and are never read.
+        grams = [sum(blocks[a] for a in np.flatnonzero(in_atom[:, s]))
+                 for s in range(nsamples)]
+
+        def solve(job):
+            spec, subset, xcols, ycol, s = job
+            G = grams[s]
+            if np.isscalar(G) or not G[one, one]:
+                return None
+            names = columns[xcols]
+            nobs = G[one, one]
+            params, cov, ssr, tss, rank = solve_moments(
+                G[np.ix_(xcols, xcols)], G[xcols, ycol], G[ycol, ycol],
+                G[one, ycol], nobs, has_const='Intercept' in names)
+            k = len(names)
+            return (np.repeat(spec, k), np.repeat(subset, k), names, params,
+                    np.sqrt(np.diag(cov)), np.full(k, nobs),
+                    np.full(k, nobs - rank), np.full(k, 1.0 - ssr / tss))
+
+        fits = [fit for fit in pool.map(solve, jobs) if fit is not None]
+    if not fits:
+        raise ValueError('no specification has any complete observations')
+
+    spec, subset, term, coef, se, nobs, df_resid, r2 = [
+        np.concatenate(part) for part in zip(*fits)]
+    t = coef / se
+    return pd.DataFrame({
+        'spec': spec, 'subset': subset, 'term': term, 'coef': coef,
+        'std_err': se, 't': t, 'pvalue': 2.0 * stats.t.sf(np.abs(t), df_resid),
+        'nobs': nobs, 'rsquared': r2})
@@ -0,0 +1,217 @@
+"""Difference-in-differences effects for every village and subgroup at once.
+
+``effect_surface`` groups the rows once by the finest combination of all
+requested keys, treatment arm and survey wave and takes NaN-omitting
+counts, sums and sums of squares of the outcome per cell (one bincount
+pass over the data). Every subgroup estimate, one-way (``'sex'``) or
+crossed (``('sex', 'poor')``), is then summed from those cells, so adding
+dimensions costs O(cells) rather than another pass over the rows.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from progresa import instrument
+from progresa.kernels import factorize, group_moments
+
+DIMENSIONS = ['village', 'age_band', 'sex', 'indig', 'poor']
+
+# Left edges of the age bands; the last edge closes the final band.
+AGE_BANDS = (6, 9, 12, 15, 19)
+
+
+def age_band(age, edges=AGE_BANDS):
+    """Ordered categorical of bands such as ``'9-11'``; ages outside are NaN."""
+    labels = ['%d-%d' % (lo, hi - 1) for lo, hi in zip(edges[:-1], edges[1:])]
+    age = np.asarray(age, dtype=np.float64)
+    band = np.searchsorted(np.asarray(edges, dtype=np.float64), age, side='right') - 1
+    band[(band >= len(labels)) | np.isnan(age)] = -1
+    return pd.Categorical.from_codes(band, categories=labels, ordered=True)
+
+
+def _encode(values):
+    """Codes starting at 1 with 0 for missing, and the sorted levels."""
+    codes, levels = pd.factorize(pd.Series(values), sort=True)
+    return codes + 1, np.asarray(levels, dtype=object)
+
+
+def effect_surface(data, by=DIMENSIONS, outcome='sc', treatment='progresa',
+                   time='year', pre=97, post=98, age_bands=AGE_BANDS, cluster='village'):
+    """Tabular DiD of ``outcome`` within every level of every dimension.
+
+    Parameters
+    ----------
+    by : list
+        Dimensions: column names, or tuples of names for crossed groups.
+        ``'age_band'`` is derived from ``age`` with ``age_bands``, using the
+        age at each survey.
+    cluster : str
+        Unit of assignment (treatment is constant within it) and of the
+        clustered variances. Rows with a missing cluster are left out.
+
+    Returns a tidy DataFrame with one row per (dimension, level): the
+    dimension name (``'sex x poor'`` for crosses), one column per key
+    (NaN where the dimension does not use it), the counts and means of the
+    four arm x wave cells, ``effect``, the number of ``clusters`` behind
+    it, its ``variance``, ``se``, ``t`` and a normal ``pvalue``.
+
+    A level holding both arms gets the usual within-level DiD. A level
+    holding one arm only (a village, or a village crossed with other keys)
+    is contrasted with the pooled control change of the levels sharing its
+    keys other than ``cluster``: a poor treated village against all poor
+    controls, so control villages give a placebo distribution. Variances
+    are cluster-robust over ``cluster`` (with a G / (G - 1) correction),
+    so the correlation of the same children across waves is accounted
+    for; they are NaN when an arm of the contrast spans fewer than two
+    clusters, as for a single village's own change. Levels with a missing
+    key are left out.
+    """
+    dims = [(d,) if isinstance(d, str) else tuple(d) for d in by]
+    keys = []
+    for dim in dims:
+        keys.extend(k for k in dim if k not in keys)
+
+    with instrument.span('effect_surface', 'heterogeneity', rows=len(data)):
+        wave = data[time].to_numpy()
+        arm = data[treatment].to_numpy()
+        keep = (np.isin(wave, [pre, post]) & np.isin(arm, [0, 1])
+                & pd.notna(data[cluster].to_numpy()))
+        codes, levels = [], {}
+        for key in keys:
+            if key == 'age_band' and key not in data.columns:
+                values = age_band(data['age'].to_numpy(), age_bands)
+            else:
+                values = data[key].to_numpy()
+            c, levels[key] = _encode(values[keep])
+            codes.append(c)
+        extra = [] if cluster in keys else [_encode(data[cluster].to_numpy()[keep])[0]]
+        arm = arm[keep].astype(np.int64)
+        late = (wave[keep] == post).astype(np.int64)
+        y = data[outcome].to_numpy(dtype=np.float64)[keep]
+
+        fine, uniques = factorize(*(codes + extra + [arm, late]))
+        count, total, sumsq, shift = group_moments(fine, y, len(uniques[0]))
+        names = keys + ['_cluster'] * len(extra) + ['_arm', '_late']
+        cell = dict(zip(names, uniques))
+        if cluster in keys:
+            cell['_cluster'] = cell[cluster]
+        cell['_slot'] = cell['_arm'] * 2 + cell['_late']
+        cell['_n'], cell['_s'], cell['_ss'] = count[:, 0], total[:, 0], sumsq[:, 0]
+
+        tables = [_dimension(dim, cell, shift[0], levels, cluster) for dim in dims]
+    table = pd.concat(tables, ignore_index=True)
+    return table[['dimension'] + keys + [c for c in table.columns
+                                        if c != 'dimension' and c not in keys]]
+
+
+def _cell_stats(n, s, ss, shift):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = shift + s / n
+        var = np.where(n > 1, (ss - s * s / n) / (n - 1), np.nan)
+    return n, mean, var
+
+
+def _distinct(nout, *keys):
+    """Distinct combinations of ``keys`` counted per value of the first."""
+    if not len(keys[0]):
+        return np.zeros(nout, dtype=np.int64)
+    first = factorize(*keys)[1][0]
+    return np.bincount(first, minlength=nout)
+
+
+def _dimension(dim, cell, shift, levels, cluster):
+    """Effects for the levels of one dimension from the fine cells."""
+    slot, group, cn, cs = cell['_slot'], cell['_cluster'], cell['_n'], cell['_s']
+    late, arm = cell['_late'], cell['_arm']
+    present = np.all([cell[key] > 0 for key in dim], axis=0)
+    level, uniques = factorize(*[cell[key][present] for key in dim])
+    nlevels = len(uniques[0])
+    index = level * 4 + slot[present]
+    n, s, ss = [np.bincount(index, weights=stat[present], minlength=nlevels * 4)
+                .reshape(nlevels, 4) for stat in (cn, cs, cell['_ss'])]
+    n, mean, var = _cell_stats(n, s, ss, shift)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        change = mean[:, 1::2] - mean[:, 0::2]
+    has_arm = (n[:, 0::2] + n[:, 1::2]) > 0
+    within = has_arm.all(axis=1)
+
+    # One-arm levels are contrasted with the controls sharing their other keys.
+    other = [key for key in dim if key != cluster]
+    ref = np.zeros(len(slot), dtype=np.int64)
+    nref = 1
+    if other:
+        shared = np.all([cell[key] > 0 for key in other], axis=0)
+        ref[shared], ref_uniques = factorize(*[cell[key][shared] for key in other])
+        nref = len(ref_uniques[0])
+    else:
+        shared = np.ones(len(slot), dtype=bool)
+    level_ref = np.zeros(nlevels, dtype=np.int64)
+    level_ref[level] = ref[present]
+    controls = shared & (arm == 0)
+    rindex = ref[controls] * 2 + late[controls]
+    rn, rs = [np.bincount(rindex, weights=stat[controls], minlength=nref * 2)
+              .reshape(nref, 2) for stat in (cn, cs)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rmean = rs / rn
+    control_change = rmean[:, 1] - rmean[:, 0]
+    own = np.where(has_arm[:, 1], change[:, 1], change[:, 0])
+    effect = np.where(within, change[:, 1] - change[:, 0], own - control_change[level_ref])
+
+    # Cluster scores: each cell's deviations from its level-slot mean,
+    # weighted by the cell's coefficient in the effect.
+    L, sl = level, slot[present]
+    sign = np.where(late[present] == 1, 1.0, -1.0)
+    sign = np.where(within[L] & (arm[present] == 0), -sign, sign)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        score = sign * (cs[present] - cn[present] * s[L, sl] / n[L, sl]) / n[L, sl]
+    pair, (pair_level, pair_group) = factorize(L, group[present])
+    own_score = np.bincount(pair, weights=score, minlength=len(pair_level))
+    nclusters = group.max() + 1
+    R, rl = ref[controls], late[controls]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rscore = (-np.where(rl == 1, 1.0, -1.0)
+                  * (cs[controls] - cn[controls] * rmean[R, rl]) / rn[R, rl])
+    flat = R * nclusters + group[controls]
+    ref_score = np.bincount(flat, weights=rscore, minlength=nref * nclusters) \
+        .reshape(nref, nclusters)
+    ref_has = (np.bincount(flat, weights=cn[controls], minlength=nref * nclusters) > 0) \
+        .reshape(nref, nclusters)
+    partner = level_ref[pair_level]
+    own_sq = np.bincount(pair_level, weights=own_score ** 2, minlength=nlevels)
+    cross = np.bincount(pair_level, weights=own_score * ref_score[partner, pair_group],
+                        minlength=nlevels)
+    raw = own_sq + np.where(within, 0.0, 2.0 * cross + (ref_score ** 2).sum(axis=1)[level_ref])
+
+    # Clusters with at least one observation, per level and arm.
+    obs = cn[present] > 0
+    own_clusters = _distinct(nlevels * 2, (L * 2 + arm[present])[obs], group[present][obs]) \
+        .reshape(nlevels, 2)
+    ref_clusters = ref_has.sum(axis=1)[level_ref]
+    pair_obs = np.bincount(pair, weights=cn[present], minlength=len(pair_level)) > 0
+    overlap = np.bincount(pair_level, weights=pair_obs & ref_has[partner, pair_group],
+                          minlength=nlevels)
+    clusters = np.where(within, own_clusters.sum(axis=1),
+                        own_clusters.sum(axis=1) + ref_clusters - overlap)
+    identified = np.where(within, (own_clusters >= 2).all(axis=1),
+                          (own_clusters.max(axis=1) >= 2) & (ref_clusters >= 2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = np.where(identified, raw * clusters / (clusters - 1.0), np.nan)
+        se = np.sqrt(variance)
+        t = effect / se
+
+    out = pd.DataFrame({'dimension': ' x '.join(dim)}, index=np.arange(nlevels))
+    for key, u in zip(dim, uniques):
+        out[key] = levels[key][u - 1]
+    out['contrast'] = np.where(within, 'within', 'pooled_control')
+    out['treated'] = np.where(within, np.nan, has_arm[:, 1].astype(np.float64))
+    for j, name in enumerate(['control_pre', 'control_post', 'treated_pre', 'treated_post']):
+        out['n_' + name] = n[:, j].astype(np.int64)
+        out['mean_' + name] = mean[:, j]
+    out['effect'] = effect
+    out['clusters'] = clusters.astype(np.int64)
+    out['variance'] = variance
+    out['se'] = se
+    out['t'] = t
+    out['pvalue'] = 2.0 * stats.norm.sf(np.abs(t))
+    return out
@@ -0,0 +1,199 @@
+"""Per-stage timing and memory instrumentation with Chrome-trace export.
+
+Pipeline stages and the internal hot spots (filters, group-bys, design
+matrix construction, normal-equation solves, cluster covariances) are
+wrapped in ``span`` blocks. Each span records wall time, CPU time of the
+whole process (including worker threads and finished worker processes)
+and of its own thread, rows processed and the process's peak resident
+memory, so CPU-bound work shows ``cpu`` near or above ``wall`` and waiting
+shows it far below. Tracing is
+off by default and a disabled ``span`` is a shared no-op, so the wrapped
+code pays one function call.
+
+Switch it on with ``python -m progresa run --trace trace.json`` or, for any
+program (including the notebook script), with the environment variable
+``PROGRESA_TRACE=trace.json``; the trace is then written at exit and a
+summary table printed to stderr. Open the file in ``chrome://tracing`` or
+Perfetto to see stages side by side on their threads.
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ENV = 'PROGRESA_TRACE'
+
+_tracer = None
+
+
+def _process_cpu():
+    """CPU seconds of this process and of its reaped children."""
+    t = os.times()
+    return time.process_time() + t.children_user + t.children_system
+
+
+def _max_rss():
+    """Peak resident set size of the process in bytes (0 if unknown)."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _NullSpan(object):
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    """One timed block; set ``rows`` inside the block if it is known late."""
+
+    def __init__(self, tracer, name, category, rows):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.rows = rows
+
+    def __enter__(self):
+        self._rss = _max_rss()
+        self._cpu = _process_cpu()
+        self._thread_cpu = time.thread_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._start
+        cpu = _process_cpu() - self._cpu
+        thread_cpu = time.thread_time() - self._thread_cpu
+        rss = _max_rss()
+        self.tracer.record({
+            'name': self.name, 'category': self.category,
+            'start': self._start - self.tracer.origin, 'wall': wall, 'cpu': cpu,
+            'thread_cpu': thread_cpu, 'rows': self.rows, 'max_rss': rss,
+            'rss_growth': rss - self._rss,
+            'thread': threading.get_ident(), 'error': exc[0] is not None,
+        })
+        return False
+
+
+class Tracer(object):
+    """Thread-safe collector of finished spans."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def span(self, name, category='', rows=None):
+        return Span(self, name, category, rows)
+
+    def record(self, entry):
+        with self._lock:
+            self.records.append(entry)
+
+    def chrome_trace(self):
+        """The spans as a Chrome trace-event document (complete events)."""
+        pid = os.getpid()
+        events = []
+        for r in self.records:
+            args = {'cpu_ms': r['cpu'] * 1e3, 'thread_cpu_ms': r['thread_cpu'] * 1e3,
+                    'max_rss_bytes': r['max_rss'],
+                    'rss_growth_bytes': r['rss_growth']}
+            if r['rows'] is not None:
+                args['rows'] = int(r['rows'])
+            if r['error']:
+                args['error'] = True
+            events.append({'name': r['name'], 'cat': r['category'] or 'internal',
+                           'ph': 'X', 'ts': r['start'] * 1e6, 'dur': r['wall'] * 1e6,
+                           'pid': pid, 'tid': r['thread'], 'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self):
+        """Tidy table per span name, slowest first.
+
+        Columns: ``name``, ``category``, ``calls``, ``wall_s``, ``cpu_s``,
+        ``thread_cpu_s``, ``rows``, ``max_rss_bytes``, ``rss_growth_bytes``.
+        Times and rows are totals over calls; nested spans are also counted
+        in their parents, so the column does not add up to the run time.
+        ``cpu_s`` is process-wide, so spans running concurrently (stages on
+        the pipeline's thread pool) also see each other's CPU time;
+        ``thread_cpu_s`` is the span's own thread only.
+        """
+        import pandas as pd
+
+        columns = ['name', 'category', 'calls', 'wall_s', 'cpu_s', 'thread_cpu_s',
+                   'rows', 'max_rss_bytes', 'rss_growth_bytes']
+        if not self.records:
+            return pd.DataFrame(columns=columns)
+        frame = pd.DataFrame(self.records)
+        table = frame.groupby(['name', 'category'], sort=False).agg(
+            calls=('wall', 'size'), wall_s=('wall', 'sum'), cpu_s=('cpu', 'sum'),
+            thread_cpu_s=('thread_cpu', 'sum'),
+            rows=('rows', lambda r: r.sum(min_count=1)),
+            max_rss_bytes=('max_rss', 'max'), rss_growth_bytes=('rss_growth', 'sum'))
+        table = table.reset_index().sort_values('wall_s', ascending=False)
+        return table.reset_index(drop=True)[columns]
+
+
+def span(name, category='', rows=None):
+    """Context manager timing the enclosed block when tracing is on."""
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, category, rows)
+
+
+def active():
+    return _tracer is not None
+
+
+def tracer():
+    """The running ``Tracer`` (``None`` when tracing is off)."""
+    return _tracer
+
+
+def enable(path=None):
+    """Start collecting spans; with ``path``, write the trace at exit."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    if path:
+        atexit.register(_finish, _tracer, path)
+    return _tracer
+
+
+def disable():
+    """Stop collecting; returns the tracer with what was recorded."""
+    global _tracer
+    collected, _tracer = _tracer, None
+    return collected
+
+
+def _finish(collected, path):
+    collected.write(path)
+    if collected.records:
+        sys.stderr.write('%s\ntrace written to %s\n'
+                         % (collected.summary().to_string(index=False), path))
+
+
+if os.environ.get(ENV):
+    enable(os.environ[ENV])
@@ -0,0 +1,209 @@
+"""Reading progresa_sample.csv through a typed, memory-mapped column cache.
+
+The CSV is parsed once into one raw binary file per column plus a
+``manifest.json`` describing the schema and the source file's SHA-256.
+Later runs memory-map those files instead of parsing the CSV again, and the
+cache is rebuilt only when the source file's content changes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from progresa import instrument
+
+CACHE_VERSION = 1
+
+# Storage dtype of every known column. Flags that are never missing are int8,
+# flags and small counts that can be missing are float32 (NaN survives), and
+# continuous money/distance/index variables stay float64.
+SCHEMA = {
+    'year': 'int16',
+    'sex': 'float32',
+    'indig': 'float32',
+    'dist_sec': 'float64',
+    'sc': 'float32',
+    'grc': 'float32',
+    'fam_n': 'float32',
+    'min_dist': 'float64',
+    'dist_cap': 'float64',
+    'poor': 'int8',
+    'progresa': 'int8',
+    'hohedu': 'float32',
+    'hohwag': 'float64',
+    'welfare_index': 'float64',
+    'hohsex': 'float32',
+    'hohage': 'float32',
+    'age': 'float32',
+    'village': 'int32',
+    'folnum': 'int32',
+    'grc97': 'float32',
+    'sc97': 'float32',
+}
+
+# Survey labels recoded to 0/1 flags: poor ('pobre' = 1) and treatment
+# ('basal' = 1). Already numeric 0/1 extracts are accepted as well.
+LABELS = {
+    'poor': {'pobre': 1, 'no pobre': 0, '1': 1, '0': 0},
+    'progresa': {'basal': 1, '0': 0, '1': 1},
+}
+
+
+def file_sha256(path, blocksize=1 << 23):
+    """SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def convert_chunk(chunk):
+    """Cast a raw CSV chunk to the cache schema.
+
+    Columns missing from ``SCHEMA`` are parsed as float64.
+    """
+    out = {}
+    for name in chunk.columns:
+        col = chunk[name]
+        dtype = np.dtype(SCHEMA.get(name, 'float64'))
+        if name in LABELS:
+            codes = col.astype(str).str.strip().map(LABELS[name])
+            if codes.isna().any():
+                bad = sorted(col[codes.isna()].astype(str).unique())[:5]
+                raise ValueError('unexpected %s labels: %s' % (name, bad))
+            col = codes
+        else:
+            col = pd.to_numeric(col, errors='raise')
+        if dtype.kind in 'iu' and col.isna().any():
+            raise ValueError('column %r has missing values but is stored as %s'
+                             % (name, dtype))
+        out[name] = col.to_numpy(dtype=dtype)
+    return pd.DataFrame(out, index=chunk.index)
+
+
+def read_csv_chunks(path, chunksize=1000000, columns=None):
+    """Yield schema-converted chunks of a Progresa-shaped CSV."""
+    reader = pd.read_csv(path, chunksize=chunksize, usecols=columns,
+                         dtype={name: str for name in LABELS})
+    for chunk in reader:
+        yield convert_chunk(chunk)
+
+
+def default_cache_dir(path):
+    return os.path.splitext(os.path.abspath(path))[0] + '.cache'
+
+
+def _source_info(path):
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns}
+
+
+def _read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != CACHE_VERSION:
+        return None
+    return manifest
+
+
+def _write_manifest(cache_dir, manifest):
+    tmp = os.path.join(cache_dir, 'manifest.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(cache_dir, 'manifest.json'))
+
+
+def _is_fresh(path, manifest):
+    """True when the cached manifest still describes the source file.
+
+    Size and mtime are checked first; only when they differ is the file
+    re-hashed, so touching the CSV without changing it does not rebuild.
+    """
+    if manifest is None:
+        return False
+    info = _source_info(path)
+    cached = manifest['source']
+    if info['size'] == cached['size'] and info['mtime_ns'] == cached['mtime_ns']:
+        return True
+    if info['size'] != cached['size']:
+        return False
+    return file_sha256(path) == cached['sha256']
+
+
+def build_cache(path, cache_dir=None, chunksize=1000000):
+    """Parse ``path`` once and write the column cache; return its manifest."""
+    cache_dir = cache_dir or default_cache_dir(path)
+    tmp_dir = cache_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    info = _source_info(path)
+    files = {}
+    dtypes = {}
+    nrows = 0
+    try:
+        with instrument.span('build_cache', 'io') as span:
+            for chunk in read_csv_chunks(path, chunksize=chunksize):
+                for name in chunk.columns:
+                    if name not in files:
+                        if nrows:
+                            raise ValueError('column %r first seen after row %d'
+                                             % (name, nrows))
+                        files[name] = open(os.path.join(tmp_dir, name + '.bin'), 'wb')
+                        dtypes[name] = chunk[name].dtype.str
+                    files[name].write(np.ascontiguousarray(chunk[name].to_numpy()).tobytes())
+                nrows += len(chunk)
+            span.rows = nrows
+    finally:
+        for f in files.values():
+            f.close()
+
+    info['sha256'] = file_sha256(path)
+    manifest = {'version': CACHE_VERSION, 'source': info, 'nrows': nrows,
+                'columns': [[name, dtypes[name]] for name in files]}
+    _write_manifest(tmp_dir, manifest)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    return manifest
+
+
+def load_progresa(path='progresa_sample.csv', cache_dir=None, columns=None,
+                  rebuild=False, chunksize=1000000):
+    """Load the survey as a DataFrame backed by the memory-mapped cache.
+
+    ``poor`` and ``progresa`` come back as int8 0/1 flags. Columns are mapped
+    copy-on-write, so in-place edits stay private to the process and never
+    touch the cache files. ``attrs['sha256']`` holds the source file's
+    SHA-256 from the manifest.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    manifest = None if rebuild else _read_manifest(cache_dir)
+    if not _is_fresh(path, manifest):
+        manifest = build_cache(path, cache_dir, chunksize=chunksize)
+    elif manifest['source']['mtime_ns'] != os.stat(path).st_mtime_ns:
+        # Same content under a new mtime: remember it so we don't re-hash.
+        manifest['source'].update(_source_info(path))
+        _write_manifest(cache_dir, manifest)
+
+    nrows = manifest['nrows']
+    data = {}
+    for name, dtype in manifest['columns']:
+        if columns is not None and name not in columns:
+            continue
+        if nrows:
+            data[name] = np.memmap(os.path.join(cache_dir, name + '.bin'),
+                                   dtype=np.dtype(dtype), mode='c', shape=(nrows,))
+        else:
+            data[name] = np.empty(0, dtype=np.dtype(dtype))
+    frame = pd.DataFrame(data, copy=False)
+    frame.attrs['sha256'] = manifest['source']['sha256']
+    return frame
@@ -0,0 +1,69 @@
+"""Grouped reduction kernels shared by the analysis modules."""
+
+import numpy as np
+import pandas as pd
+
+
+def factorize(*keys):
+    """Dense group codes for the combination of one or more key arrays.
+
+    Returns ``(codes, uniques)`` where ``uniques`` is a list with one array
+    per key, sorted lexicographically, so ``uniques[j][codes]`` recovers key
+    ``j`` for every row.
+    """
+    if not keys:
+        raise ValueError('at least one key is required')
+    combined = np.zeros(len(keys[0]), dtype=np.int64)
+    levels = []
+    for key in keys:
+        codes, uniques = pd.factorize(np.asarray(key), sort=True)
+        if (codes < 0).any():
+            raise ValueError('group keys must not be missing')
+        combined = combined * len(uniques) + codes
+        levels.append(uniques)
+    codes, cells = pd.factorize(combined, sort=True)
+    uniques = []
+    for j in range(len(keys) - 1, -1, -1):
+        uniques.append(levels[j][cells % len(levels[j])])
+        cells = cells // len(levels[j])
+    return codes, uniques[::-1]
+
+
+def group_sums(codes, values, ngroups):
+    """Per-group sums of a 1-d or 2-d float array (one bincount per column)."""
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        return np.bincount(codes, weights=values, minlength=ngroups)
+    out = np.empty((ngroups, values.shape[1]))
+    for j in range(values.shape[1]):
+        out[:, j] = np.bincount(codes, weights=values[:, j], minlength=ngroups)
+    return out
+
+
+def group_moments(codes, values, ngroups, shift=None):
+    """NaN-omitting count, sum and sum of squares per group and column.
+
+    ``values`` is ``(n, k)``. Sums are taken of ``values - shift`` (``shift``
+    defaults to the column means) so the sum of squares does not lose
+    precision on large-valued columns; the shift is returned with the
+    moments and callers add it back to recover means.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, None]
+    if shift is None:
+        with np.errstate(invalid='ignore'):
+            shift = np.nanmean(values, axis=0) if len(values) else np.zeros(values.shape[1])
+        shift = np.where(np.isfinite(shift), shift, 0.0)
+    k = values.shape[1]
+    count = np.empty((ngroups, k))
+    total = np.empty((ngroups, k))
+    sumsq = np.empty((ngroups, k))
+    for j in range(k):
+        dev = values[:, j] - shift[j]
+        ok = ~np.isnan(dev)
+        dev = np.where(ok, dev, 0.0)
+        count[:, j] = np.bincount(codes, weights=ok, minlength=ngroups)
+        total[:, j] = np.bincount(codes, weights=dev, minlength=ngroups)
+        sumsq[:, j] = np.bincount(codes, weights=dev * dev, minlength=ngroups)
+    return count, total, sumsq, shift
@@ -0,0 +1,172 @@
+"""Nearest-neighbour and propensity-score matching estimates of the ATT.
+
+Treatment and control villages differ at baseline in distances, household
+head characteristics and the welfare index. ``match_att`` matches every
+treated child, with replacement, to its ``k`` nearest controls on those
+covariates (Mahalanobis distance) or on the estimated propensity score and
+averages the treated-minus-matched outcome differences.
+
+Neighbours come from a KD-tree built over the controls
+(``scipy.spatial.cKDTree``), not from the treated x control distance
+matrix: the build is O(n log n) and each query about O(log n). Queries run
+in batches, each spread over ``n_jobs`` threads, and a caliper bounds the
+search so far-away controls are never visited.
+"""
+
+import collections
+
+import numpy as np
+import pandas as pd
+from scipy import linalg, spatial
+
+from progresa import instrument
+from progresa.binary import newton_binary
+
+# Baseline covariates that differ between treatment and control villages.
+MATCH_COVARIATES = ['dist_sec', 'min_dist', 'dist_cap', 'hohedu', 'hohwag',
+                    'hohage', 'welfare_index']
+
+MatchingResult = collections.namedtuple(
+    'MatchingResult', ['method', 'att', 'n_treated', 'n_matched', 'n_controls',
+                       'balance', 'pairs'])
+
+
+def metric_space(Z, treated, method='mahalanobis'):
+    """Coordinates in which Euclidean distance is the matching distance.
+
+    ``'mahalanobis'`` whitens ``Z`` with the Cholesky factor of its
+    covariance. ``'propensity'`` fits a logit of ``treated`` on ``Z`` and
+    returns the linear predictor in units of its standard deviation, so a
+    caliper of 0.2 is the usual 0.2 SD of the logit of the score.
+    """
+    centered = Z - Z.mean(axis=0)
+    if method == 'mahalanobis':
+        chol = np.linalg.cholesky(np.atleast_2d(np.cov(centered, rowvar=False)))
+        return linalg.solve_triangular(chol, centered.T, lower=True).T
+    if method == 'propensity':
+        scale = centered.std(axis=0)
+        scale[scale == 0] = 1.0
+        X = np.column_stack([np.ones(len(Z)), centered / scale])
+        fit = newton_binary(X, treated.astype(np.float64), 'logit')
+        if not fit.converged:
+            raise RuntimeError('propensity model did not converge')
+        score = X @ fit.params
+        return (score / score.std())[:, None]
+    raise ValueError("method must be 'mahalanobis' or 'propensity', not %r" % (method,))
+
+
+def nearest(points, reference, k=1, caliper=None, batch=65536, n_jobs=None):
+    """The ``k`` nearest ``reference`` rows of every row of ``points``.
+
+    Returns ``(distance, index)``, both ``(len(points), k)``. Neighbours
+    beyond ``caliper`` have infinite distance and index ``len(reference)``.
+    ``n_jobs`` threads share each batch of queries (default: all cores).
+    """
+    tree = spatial.cKDTree(reference)
+    bound = np.inf if caliper is None else caliper
+    distance = np.empty((len(points), k))
+    index = np.empty((len(points), k), dtype=np.intp)
+    for start in range(0, len(points), batch):
+        stop = start + batch
+        distance[start:stop], index[start:stop] = tree.query(
+            points[start:stop], k=list(range(1, k + 1)), distance_upper_bound=bound,
+            workers=-1 if n_jobs is None else n_jobs)
+    return distance, index
+
+
+def _moments(Z, weights=None):
+    """Mean and sample variance, with ``weights`` as frequency weights
+    (``ddof=1`` on their sum, so unit weights give ``Z.var(ddof=1)``)."""
+    if weights is None:
+        weights = np.ones(len(Z))
+    total = weights.sum()
+    mean = weights @ Z / total
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return mean, weights @ (Z - mean) ** 2 / (total - 1.0)
+
+
+def _balance(covariates, Z_treated, Z_control, matched, weights):
+    """Standardized differences and variance ratios before and after."""
+    m1, v1 = _moments(Z_treated)
+    m0, v0 = _moments(Z_control)
+    mm1, mv1 = _moments(Z_treated[matched])
+    mm0, mv0 = _moments(Z_control, weights)
+    pooled = np.sqrt((v1 + v0) / 2.0)
+    pooled[pooled == 0] = np.nan
+    return pd.DataFrame({
+        'covariate': list(covariates),
+        'mean_treated': m1, 'mean_control': m0,
+        'smd': (m1 - m0) / pooled, 'variance_ratio': v1 / v0,
+        'mean_treated_matched': mm1, 'mean_control_matched': mm0,
+        'smd_matched': (mm1 - mm0) / pooled, 'variance_ratio_matched': mv1 / mv0,
+    })
+
+
+def match_att(data, covariates=MATCH_COVARIATES, outcome='sc', treatment='progresa',
+              method='mahalanobis', k=1, caliper=None, subset=None, batch=65536,
+              n_jobs=None):
+    """Matching estimate of the average treatment effect on the treated.
+
+    Parameters
+    ----------
+    data : DataFrame
+        One row per unit, e.g. the poor in 1998.
+    covariates : list of str
+        Columns to match on; rows missing any of them, the outcome or the
+        treatment are dropped.
+    method : {'mahalanobis', 'propensity'}
+        Match on the covariates or on the estimated propensity score.
+    k : int
+        Controls per treated unit (with replacement).
+    caliper : float, optional
+        Largest allowed distance: Mahalanobis units, or standard deviations
+        of the linear propensity score. Treated units with no control
+        inside it are left out of the ATT.
+    subset : str, optional
+        ``DataFrame.query`` expression applied first.
+
+    Returns a ``MatchingResult``. ``balance`` holds per-covariate means,
+    standardized mean differences (over the pre-matching pooled standard
+    deviation) and variance ratios, before and after matching, with
+    controls weighted by how often they are used. ``pairs`` has one row
+    per treated/control pair: both index labels and the distance.
+    No standard error is reported; matching with replacement makes the
+    bootstrap invalid here (Abadie and Imbens, 2008).
+    """
+    if subset:
+        data = data.query(subset)
+    covariates = list(covariates)
+    frame = data[[outcome, treatment] + covariates].dropna()
+    treated = frame[treatment].to_numpy() == 1
+    y = frame[outcome].to_numpy(dtype=np.float64)
+    Z = frame[covariates].to_numpy(dtype=np.float64)
+    t_rows = np.flatnonzero(treated)
+    c_rows = np.flatnonzero(~treated)
+    if not len(t_rows) or len(c_rows) < k:
+        raise ValueError('need treated units and at least %d controls' % k)
+
+    with instrument.span('match', 'matching', rows=len(frame)):
+        space = metric_space(Z, treated, method)
+        distance, neighbour = nearest(space[t_rows], space[c_rows], k=k,
+                                      caliper=caliper, batch=batch, n_jobs=n_jobs)
+    found = np.isfinite(distance)
+    nfound = found.sum(axis=1)
+    matched = nfound > 0
+    if not matched.any():
+        raise ValueError('no treated unit has a control within the caliper')
+    neighbour = np.where(found, neighbour, 0)
+
+    # Each matched treated unit spreads a weight of one over its controls.
+    share = np.where(found, 1.0 / np.maximum(nfound, 1)[:, None], 0.0)
+    counterfactual = (share * y[c_rows][neighbour]).sum(axis=1)
+    att = float(np.mean(y[t_rows][matched] - counterfactual[matched]))
+    weights = np.bincount(neighbour[matched].ravel(), weights=share[matched].ravel(),
+                          minlength=len(c_rows))
+
+    pair_t, pair_j = np.nonzero(found)
+    pairs = pd.DataFrame({'treated': frame.index[t_rows[pair_t]],
+                          'control': frame.index[c_rows[neighbour[pair_t, pair_j]]],
+                          'distance': distance[pair_t, pair_j]})
+    balance = _balance(covariates, Z[t_rows], Z[c_rows], matched, weights)
+    return MatchingResult(method, att, len(t_rows), int(matched.sum()),
+                          int((weights > 0).sum()), balance, pairs)
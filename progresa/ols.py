@@ -0,0 +1,110 @@
+"""Least squares from accumulated cross-products.
+
+Every estimator in the package that can be written in terms of X'X, X'y,
+y'y and n ends up here, so coefficients, standard errors and R-squared are
+computed the same way (and match ``statsmodels`` ``ols(...).fit()``).
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from progresa import instrument
+
+
+class OLSResults(object):
+    """Coefficient table and fit statistics of a least-squares fit.
+
+    Mirrors the parts of the ``statsmodels`` results API the analysis uses:
+    ``params``, ``bse``, ``tvalues``, ``pvalues``, ``rsquared``,
+    ``rsquared_adj``, ``nobs``, ``df_resid``, ``cov_params()`` and
+    ``summary_frame()``. ``df_inference`` is the degrees of freedom of the
+    t distribution used for p-values (``df_resid`` unless a robust
+    covariance says otherwise, e.g. clusters - 1).
+    """
+
+    def __init__(self, names, params, cov, nobs, df_resid, ssr, centered_tss,
+                 cov_type='nonrobust', df_model=None, df_inference=None):
+        self.names = list(names)
+        self.params = pd.Series(params, index=self.names)
+        self._cov = np.asarray(cov)
+        self.nobs = float(nobs)
+        self.df_resid = float(df_resid)
+        self.df_model = float(len(self.names) - 1 if df_model is None else df_model)
+        self.ssr = float(ssr)
+        self.centered_tss = float(centered_tss)
+        self.cov_type = cov_type
+        self.df_inference = self.df_resid if df_inference is None else float(df_inference)
+
+    def cov_params(self):
+        return pd.DataFrame(self._cov, index=self.names, columns=self.names)
+
+    @property
+    def scale(self):
+        return self.ssr / self.df_resid
+
+    @property
+    def bse(self):
+        return pd.Series(np.sqrt(np.diag(self._cov)), index=self.names)
+
+    @property
+    def tvalues(self):
+        return self.params / self.bse
+
+    @property
+    def pvalues(self):
+        return pd.Series(2.0 * stats.t.sf(np.abs(self.tvalues), self.df_inference),
+                         index=self.names)
+
+    @property
+    def rsquared(self):
+        return 1.0 - self.ssr / self.centered_tss
+
+    @property
+    def rsquared_adj(self):
+        return 1.0 - (self.nobs - 1) / self.df_resid * (1.0 - self.rsquared)
+
+    def summary_frame(self):
+        """Tidy coefficient table: coef, std err, t, P>|t|."""
+        return pd.DataFrame({'coef': self.params, 'std err': self.bse,
+                             't': self.tvalues, 'P>|t|': self.pvalues})
+
+    def __repr__(self):
+        return '<OLSResults nobs=%d, k=%d, R2=%.4f>' % (self.nobs, len(self.names),
+                                                       self.rsquared)
+
+
+def solve_normal(xtx, xty):
+    """Solve X'X b = X'y with column equilibration; return ``(b, (X'X)^-1)``.
+
+    Uses the pseudo-inverse, like ``statsmodels``, so a rank-deficient design
+    returns the minimum-norm solution instead of failing.
+    """
+    with instrument.span('solve', 'ols'):
+        xtx = np.asarray(xtx, dtype=np.float64)
+        d = np.sqrt(np.diag(xtx))
+        d[d == 0] = 1.0
+        inv = np.linalg.pinv(xtx / np.outer(d, d), hermitian=True) / np.outer(d, d)
+        return inv @ xty, inv
+
+
+def solve_moments(xtx, xty, yty, ysum, nobs, has_const=True):
+    """Array-level OLS from cross-products.
+
+    Returns ``(params, cov, ssr, centered_tss, rank)``; ``has_const``
+    decides whether the total sum of squares is centered, as ``statsmodels``
+    does for models with an intercept.
+    """
+    params, inv = solve_normal(xtx, xty)
+    ssr = max(yty - 2.0 * params @ xty + params @ xtx @ params, 0.0)
+    rank = np.linalg.matrix_rank(xtx)
+    tss = yty - ysum * ysum / nobs if has_const else yty
+    return params, inv * (ssr / (nobs - rank)), ssr, tss, rank
+
+
+def ols_from_moments(names, xtx, xty, yty, ysum, nobs, has_const=True):
+    """Fit OLS from X'X, X'y, y'y, sum(y) and n; returns ``OLSResults``."""
+    params, cov, ssr, tss, rank = solve_moments(xtx, xty, yty, ysum, nobs,
+                                                has_const=has_const)
+    return OLSResults(names, params, cov, nobs, nobs - rank, ssr, tss,
+                      df_model=rank - int(has_const))
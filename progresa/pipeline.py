@@ -0,0 +1,532 @@
+"""Headless pipeline: the notebook's sections as a DAG of named stages.
+
+Each stage declares the stages it consumes; independent stages run
+concurrently on a thread pool. Heavy libraries are imported inside the
+stages that need them (the regressions use ``progresa.inference`` rather
+than statsmodels), figures are drawn on matplotlib's Agg canvas without
+``pyplot``, and every stage writes machine-readable outputs to its own
+directory: tables as JSON (or Parquet), scalar results as
+``results.json`` and plots as PNG. With ``--trace`` every stage and the
+hot spots inside it are timed (see ``progresa.instrument``).
+
+    python -m progresa run progresa_sample.csv --out results --jobs 4
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import inspect
+import io
+import json
+import os
+import sys
+import time
+
+from progresa import instrument
+
+Stage = collections.namedtuple('Stage', ['name', 'inputs', 'func', 'artifacts', 'params'])
+
+STAGES = collections.OrderedDict()
+
+
+def stage(name, inputs=(), artifacts=True, params=None):
+    """Register ``func(config, **inputs)`` as a pipeline stage.
+
+    Artifact stages return a dict of named outputs: DataFrames are written
+    as tables, ``bytes`` as PNG files and anything else goes to the stage's
+    ``results.json``. Non-artifact stages (``load``, ``cells``) return in-memory
+    objects for downstream stages and write nothing.
+
+    ``params`` is a function returning the module-level settings the stage
+    reads (formulas, subsets); they are part of its result-cache key. It
+    defaults to the stage's own entry in ``FORMULAS``.
+    """
+    def register(func):
+        STAGES[name] = Stage(name, tuple(inputs), func, artifacts,
+                             params or (lambda: {'formula': FORMULAS.get(name)}))
+        return func
+    return register
+
+
+# Regressions of the notebook, shared by the stages below.
+FORMULAS = {
+    'simple_difference': 'sc ~ progresa',
+    'multiple_regression': ('sc ~ age + progresa + indig + dist_sec + sex + hohedu'
+                            ' + welfare_index + fam_n + hohwag + hohsex + hohage'),
+    'did_v1_regression': ('sc ~ progresa + time + progresa*time + age + indig'
+                          ' + dist_sec + sex + hohedu'),
+    'did_v2': ('sc ~ progresa + poor + progresa*poor + sex + dist_sec + min_dist'
+               ' + dist_cap + hohedu + age'),
+    'spillover': ('sc ~ progresa + time + progresa*time + sex + dist_sec + min_dist'
+                  ' + dist_cap + hohedu + age + hohage'),
+}
+
+
+# Subsample of each regression, for the logit and probit versions.
+SUBSETS = {
+    'simple_difference': 'poor == 1 and year == 98',
+    'multiple_regression': 'poor == 1 and year == 98',
+    'did_v1_regression': 'poor == 1',
+    'did_v2': 'year == 98',
+    'spillover': 'poor == 0',
+}
+
+
+def _coefficients(formula, data, cluster='village'):
+    """OLS coefficient table with iid and village-clustered inference."""
+    from progresa.inference import fit_ols
+
+    iid = fit_ols(formula, data)
+    clustered = fit_ols(formula, data, cluster=cluster)
+    table = iid.summary_frame()
+    table.columns = ['coef', 'std_err', 't', 'pvalue']
+    table['std_err_cluster'] = clustered.bse
+    table['pvalue_cluster'] = clustered.pvalues
+    table = table.rename_axis('term').reset_index()
+    fit = {'nobs': iid.nobs, 'rsquared': iid.rsquared,
+           'rsquared_adj': iid.rsquared_adj, 'formula': formula}
+    return table, fit
+
+
+def _where(data, **key):
+    """Rows of ``data`` whose columns equal the values in ``key``."""
+    with instrument.span('filter', 'pipeline', rows=len(data)):
+        mask = None
+        for name, value in key.items():
+            match = data[name].to_numpy() == value
+            mask = match if mask is None else mask & match
+        return data[mask]
+
+
+def _png(fig):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    FigureCanvasAgg(fig)
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+@stage('load', artifacts=False)
+def load(config):
+    from progresa.io import load_progresa
+
+    data = load_progresa(config['csv'], cache_dir=config.get('data_cache'))
+    data['time'] = (data['year'] == 98).astype('int8')
+    return data
+
+
+@stage('cells', inputs=['load'], artifacts=False)
+def cells(config, load):
+    from progresa.cells import CellIndex
+
+    return CellIndex.build(load)
+
+
+@stage('summary_stats', inputs=['load'])
+def summary_stats(config, load):
+    import pandas as pd
+
+    data = load.drop(['year', 'folnum', 'village', 'poor', 'progresa', 'time'], axis=1)
+    table = pd.DataFrame({'variable': data.columns,
+                          'mean': data.mean().to_numpy(),
+                          'std_dev': data.std().to_numpy()})
+    return {'summary_stats': table.sort_values('variable').reset_index(drop=True)}
+
+
+@stage('balance', inputs=['load'])
+def balance(config, load):
+    from progresa.balance import balance_table
+
+    baseline = _where(load, poor=1, year=97)
+    covariates = baseline.columns.drop(['year', 'folnum', 'village', 'poor',
+                                        'progresa', 'time'])
+    return {'balance': balance_table(baseline, covariates, group='progresa')}
+
+
+@stage('graphics', inputs=['load', 'cells'])
+def graphics(config, load, cells):
+    from matplotlib.figure import Figure
+
+    from progresa.balance import ttest_from_moments
+
+    out = {}
+    baseline = _where(load, year=97)
+    with instrument.span('groupby', 'pipeline', rows=len(baseline)):
+        by_hohedu = baseline.groupby('hohedu')['sc'].mean()
+    fig = Figure()
+    ax = fig.add_subplot()
+    ax.scatter(by_hohedu.index, by_hohedu.to_numpy())
+    ax.set_xlim(-1, 21)
+    ax.set_ylim(0, 1.5)
+    ax.set_xlabel('Household head education')
+    ax.set_ylabel('Avg_Enrollment_Rate')
+    ax.set_title('Household head education vs. Avg_Enrollment_Rate')
+    out['hohedu_enrollment'] = _png(fig)
+
+    village_means = {}
+    for year, color in ((97, 'green'), (98, None)):
+        rows = load.iloc[cells.rows(poor=1, year=year, progresa=1)]
+        with instrument.span('groupby', 'pipeline', rows=len(rows)):
+            means = rows.groupby('village')['sc'].mean().dropna()
+        village_means[year] = means.to_numpy()
+        fig = Figure()
+        ax = fig.add_subplot()
+        ax.hist(means.to_numpy(), histtype='bar', color=color)
+        ax.axvline(means.mean(), color='red', linestyle='dashed', linewidth=3)
+        ax.set_xlabel('Average Enrollment Rate (19%d)' % year)
+        ax.set_ylabel('Count of Villages')
+        ax.set_title('Histogram - Enrollment Rate for %d' % year)
+        out['village_enrollment_%d' % year] = _png(fig)
+
+    a, b = village_means[97], village_means[98]
+    t, p, _ = ttest_from_moments(len(a), a.mean(), a.var(ddof=1),
+                                 len(b), b.mean(), b.var(ddof=1))
+    out['village_mean_97'] = float(a.mean())
+    out['village_mean_98'] = float(b.mean())
+    out['village_t'] = float(t)
+    out['village_pvalue'] = float(p)
+    return out
+
+
+@stage('simple_difference', inputs=['load', 'cells'])
+def simple_difference(config, load, cells):
+    treated = dict(poor=1, year=98, progresa=1)
+    control = dict(poor=1, year=98, progresa=0)
+    test = cells.ttest('sc', treated, control)
+    table, fit = _coefficients(FORMULAS['simple_difference'],
+                               _where(load, poor=1, year=98))
+    return {'treated_mean': float(cells.mean('sc', **treated)),
+            'control_mean': float(cells.mean('sc', **control)),
+            't': float(test.statistic), 'pvalue': float(test.pvalue),
+            'coefficients': table, 'fit': fit}
+
+
+@stage('multiple_regression', inputs=['load'])
+def multiple_regression(config, load):
+    table, fit = _coefficients(FORMULAS['multiple_regression'],
+                               _where(load, poor=1, year=98))
+    return {'coefficients': table, 'fit': fit}
+
+
+@stage('matching', inputs=['load'])
+def matching(config, load):
+    from progresa.matching import match_att
+
+    data = _where(load, poor=1, year=98)
+    out = {}
+    for method, caliper in (('mahalanobis', None), ('propensity', 0.2)):
+        result = match_att(data, method=method, caliper=caliper)
+        out['att_%s' % method] = result.att
+        out['n_matched_%s' % method] = result.n_matched
+        out['balance_%s' % method] = result.balance
+    out['n_treated'] = result.n_treated
+    return out
+
+
+@stage('binary_models', inputs=['load'],
+       params=lambda: {name: [FORMULAS[name], SUBSETS[name]] for name in SUBSETS})
+def binary_models(config, load):
+    import pandas as pd
+
+    from progresa.binary import run_binary_grid
+
+    tables = []
+    for subset in sorted(set(SUBSETS.values())):
+        specs = {name: FORMULAS[name] for name in SUBSETS if SUBSETS[name] == subset}
+        for link in ('logit', 'probit'):
+            table = run_binary_grid(load, specs, {subset: subset}, link=link,
+                                    cluster='village')
+            table.insert(0, 'link', link)
+            tables.append(table)
+    return {'coefficients': pd.concat(tables, ignore_index=True)}
+
+
+@stage('did_v1_tabular', inputs=['cells'])
+def did_v1_tabular(config, cells):
+    out = {}
+    for arm, flag in (('treatment', 1), ('control', 0)):
+        for year in (97, 98):
+            out['mean_%s_%d' % (arm, year)] = float(cells.mean('sc', poor=1, year=year,
+                                                               progresa=flag))
+    out['diff_treatment'] = out['mean_treatment_98'] - out['mean_treatment_97']
+    out['diff_control'] = out['mean_control_98'] - out['mean_control_97']
+    out['diff_in_diff'] = float(cells.diff_in_diff('sc', poor=1))
+    return out
+
+
+@stage('effect_surface', inputs=['load'])
+def effect_surface(config, load):
+    from progresa.heterogeneity import effect_surface
+
+    return {'effects': effect_surface(load)}
+
+
+@stage('did_v1_regression', inputs=['load'])
+def did_v1_regression(config, load):
+    table, fit = _coefficients(FORMULAS['did_v1_regression'], _where(load, poor=1))
+    return {'coefficients': table, 'fit': fit}
+
+
+@stage('did_v2', inputs=['load'])
+def did_v2(config, load):
+    table, fit = _coefficients(FORMULAS['did_v2'], _where(load, year=98))
+    return {'coefficients': table, 'fit': fit}
+
+
+@stage('spillover', inputs=['load'])
+def spillover(config, load):
+    table, fit = _coefficients(FORMULAS['spillover'], _where(load, poor=0))
+    return {'coefficients': table, 'fit': fit}
+
+
+def resolve(names):
+    """``names`` plus everything they depend on, in registration order."""
+    needed = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in STAGES:
+            raise KeyError('unknown stage %r (known: %s)' % (name, ', '.join(STAGES)))
+        if name not in needed:
+            needed.add(name)
+            pending.extend(STAGES[name].inputs)
+    return [name for name in STAGES if name in needed]
+
+
+_LIBRARY = []
+
+
+def _library_digest():
+    """SHA-256 of every ``progresa/*.py`` source, computed once per process.
+
+    Stages call helpers here and the estimators in the other modules, so a
+    change anywhere in the package (standard errors, AMEs, matching) must
+    invalidate cached results, not only a change to the stage function.
+    """
+    if not _LIBRARY:
+        package = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(package)):
+            if name.endswith('.py'):
+                digest.update(name.encode())
+                with open(os.path.join(package, name), 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+        _LIBRARY.append(digest.hexdigest())
+    return _LIBRARY[0]
+
+
+def _data_fingerprint(data):
+    """Cache key of the loaded frame.
+
+    ``load_progresa`` already hashed the CSV for its column cache, so the
+    manifest's SHA-256 plus the columns and dtypes stand in for hashing
+    every cell; the ``load`` stage's own code is in the package digest.
+    Frames without it fall back to ``cache.fingerprint``.
+    """
+    sha = data.attrs.get('sha256')
+    if sha is None:
+        from progresa.cache import fingerprint
+        return fingerprint(data)
+    schema = [[str(c), str(t)] for c, t in data.dtypes.items()]
+    return hashlib.sha256(json.dumps([sha, len(data), schema]).encode()).hexdigest()
+
+
+def _stage_params(s):
+    """Cache parameters: the stage's source, the package sources and the
+    settings the stage reads."""
+    source = inspect.getsource(s.func)
+    return {'source': hashlib.sha256(source.encode()).hexdigest(),
+            'library': _library_digest(), 'params': s.params()}
+
+
+def write_artifacts(name, artifacts, out_dir, table_format='json'):
+    """Write one stage's artifacts under ``out_dir/name``; return the files."""
+    import pandas as pd
+
+    out_dir = os.path.join(out_dir, name)
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    scalars = {}
+    for key, value in artifacts.items():
+        if isinstance(value, pd.DataFrame):
+            path = os.path.join(out_dir, '%s.%s' % (key, table_format))
+            if table_format == 'parquet':
+                value.to_parquet(path, index=False)
+            else:
+                value.to_json(path, orient='records', indent=1)
+            written.append(path)
+        elif isinstance(value, bytes):
+            path = os.path.join(out_dir, key + '.png')
+            with open(path, 'wb') as f:
+                f.write(value)
+            written.append(path)
+        else:
+            scalars[key] = value
+    if scalars:
+        path = os.path.join(out_dir, 'results.json')
+        with open(path, 'w') as f:
+            json.dump(scalars, f, indent=1, sort_keys=True, default=float)
+        written.append(path)
+    return written
+
+
+def run(config, names=None, jobs=None, cache=None, table_format='json'):
+    """Run the requested stages (default: all) and write their outputs.
+
+    Returns ``{stage: {'seconds': ..., 'files': [...], 'cached': bool}}``.
+    """
+    order = resolve(names or list(STAGES))
+    out_dir = config['out']
+    os.makedirs(out_dir, exist_ok=True)
+    results = {}
+    report = collections.OrderedDict()
+    data_fingerprint = []
+
+    def execute(name):
+        s = STAGES[name]
+        start = time.perf_counter()
+        inputs = {dep: results[dep] for dep in s.inputs}
+        computed = []
+
+        def compute():
+            computed.append(True)
+            rows = len(inputs['load']) if 'load' in inputs else None
+            with instrument.span(name, 'stage', rows=rows) as span:
+                value = s.func(config, **inputs)
+                if name == 'load':
+                    span.rows = len(value)
+            return value
+
+        if s.artifacts and cache is not None:
+            if not data_fingerprint:
+                data_fingerprint.append(_data_fingerprint(results['load']))
+            value = cache.get_or_compute(name, compute,
+                                         data_fingerprint=data_fingerprint[0],
+                                         params=_stage_params(s))
+        else:
+            value = compute()
+        files = write_artifacts(name, value, out_dir, table_format) if s.artifacts else []
+        return value, {'seconds': time.perf_counter() - start, 'files': files,
+                       'cached': not computed}
+
+    done = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        running = {}
+        while len(done) < len(order):
+            for name in order:
+                if (name not in done and name not in running.values()
+                        and all(dep in done for dep in STAGES[name].inputs)):
+                    running[pool.submit(execute, name)] = name
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                results[name], report[name] = future.result()
+                done.add(name)
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump({'csv': config['csv'], 'stages': report}, f, indent=1)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m progresa', description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_cmd = commands.add_parser('run', help='run pipeline stages and write their outputs')
+    run_cmd.add_argument('csv', nargs='?', default='progresa_sample.csv')
+    run_cmd.add_argument('--out', default='results', help='output directory')
+    run_cmd.add_argument('--stages', help='comma-separated stages (dependencies are added)')
+    run_cmd.add_argument('--jobs', type=int, help='stages run concurrently (default: cores)')
+    run_cmd.add_argument('--data-cache', help='column cache directory for the CSV')
+    run_cmd.add_argument('--cache-dir', help='reuse stage results stored here')
+    run_cmd.add_argument('--cache-size', type=int, default=1 << 30,
+                         help='result cache size bound in bytes')
+    run_cmd.add_argument('--table-format', choices=['json', 'parquet'], default='json')
+    run_cmd.add_argument('--trace', metavar='PATH',
+                         help='time stages and hot spots; write a Chrome trace here')
+
+    commands.add_parser('list', help='list stages and their inputs')
+
+    synth_cmd = commands.add_parser('synth', help='write a synthetic Progresa-shaped CSV')
+    synth_cmd.add_argument('csv')
+    synth_cmd.add_argument('--scale', type=float, default=1.0,
+                           help='size relative to the sample (e.g. 10, 1000)')
+    synth_cmd.add_argument('--seed', type=int, default=0)
+
+    bench_cmd = commands.add_parser('bench', help='time and memory-profile every stage')
+    bench_cmd.add_argument('--scale', type=float, default=1.0)
+    bench_cmd.add_argument('--seed', type=int, default=0)
+    bench_cmd.add_argument('--repeat', type=int, default=5,
+                           help='interleaved timed passes; the median is kept')
+    bench_cmd.add_argument('--workdir', default='bench')
+    bench_cmd.add_argument('--stages', help='comma-separated stages (dependencies are added)')
+    bench_cmd.add_argument('--save', help='write the results as a baseline JSON')
+    bench_cmd.add_argument('--compare', help='baseline JSON to check against')
+    bench_cmd.add_argument('--tolerance', type=float, default=0.25,
+                           help='allowed slowdown or memory growth (fraction)')
+    bench_cmd.add_argument('--min-seconds', type=float, default=0.01,
+                           help='slowdowns below this are never regressions')
+    bench_cmd.add_argument('--min-bytes', type=int, default=1 << 20,
+                           help='memory growth below this is never a regression')
+    bench_cmd.add_argument('--absolute', action='store_true',
+                           help="compare raw times, not relative to the run's overall speed")
+
+    args = parser.parse_args(argv)
+    if args.command == 'list':
+        for s in STAGES.values():
+            print('%-20s <- %s' % (s.name, ', '.join(s.inputs) or '-'))
+        return 0
+    if args.command == 'synth':
+        from progresa.synthetic import write_csv
+        print('%d rows written to %s' % (write_csv(args.csv, args.scale, args.seed), args.csv))
+        return 0
+    if args.command == 'bench':
+        return _bench(args)
+
+    cache = None
+    if args.cache_dir:
+        from progresa.cache import ResultCache
+        cache = ResultCache(args.cache_dir, max_bytes=args.cache_size)
+    if args.trace:
+        instrument.enable()
+    config = {'csv': args.csv, 'out': args.out, 'data_cache': args.data_cache}
+    names = args.stages.split(',') if args.stages else None
+    report = run(config, names, jobs=args.jobs, cache=cache,
+                 table_format=args.table_format)
+    for name, info in report.items():
+        print('%-20s %8.3fs%s' % (name, info['seconds'], ' (cached)' if info['cached'] else ''))
+    if cache is not None:
+        print(cache.stats().to_string(index=False))
+    if args.trace:
+        tracer = instrument.disable()
+        tracer.write(args.trace)
+        print(tracer.summary().to_string(index=False))
+        print('trace written to %s' % args.trace)
+    return 0
+
+
+def _bench(args):
+    from progresa import benchmark
+
+    names = args.stages.split(',') if args.stages else None
+    table = benchmark.run_benchmarks(args.scale, args.seed, args.workdir,
+                                     repeat=args.repeat, stages=names)
+    if args.save:
+        benchmark.save_baseline(table, args.save, args.scale, args.seed)
+    if args.compare:
+        table = benchmark.compare(table, args.compare, args.scale, args.seed,
+                                  args.tolerance, args.min_seconds, args.min_bytes,
+                                  normalize=not args.absolute)
+    print(table.to_string(index=False))
+    if args.compare and table['regression'].any():
+        print('regressions: %s' % ', '.join(table.loc[table['regression'], 'stage']))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
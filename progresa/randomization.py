@@ -0,0 +1,167 @@
+"""Randomization inference for the difference-in-differences estimates.
+
+Treatment is re-assigned across villages, keeping the number of treated
+villages fixed, and the DiD estimate is recomputed for every assignment.
+Neither estimate touches row-level data once the village-by-year
+aggregates are built:
+
+* the tabular DiD is a ratio of village sums, so a batch of assignments
+  ``Z`` (V x B) is four matrix products;
+* the regression DiD (``progresa + time + progresa:time + controls``) uses
+  Frisch-Waugh-Lovell: after partialling out the intercept, ``time`` and
+  the controls, the two treatment columns depend on the assignment only
+  through per-village sums, so each draw solves a 2 x 2 system.
+"""
+
+import collections
+import itertools
+import math
+
+import numpy as np
+
+from progresa.design import build_design
+from progresa.kernels import factorize, group_sums
+from progresa.parallel import map_batches
+
+RandomizationResult = collections.namedtuple(
+    'RandomizationResult', ['estimate', 'pvalue', 'null', 'exact'])
+
+
+def _village_assignment(village, treatment):
+    codes, uniques = factorize(village)
+    nvillages = len(uniques[0])
+    z = group_sums(codes, treatment, nvillages) / np.bincount(codes, minlength=nvillages)
+    if not np.all((z == 0) | (z == 1)):
+        raise ValueError('treatment varies within a village')
+    return codes, nvillages, z
+
+
+def _tabular_stats(codes, nvillages, outcome, post):
+    """Per-village (n, sum) of the outcome in the pre and post periods."""
+    ok = ~np.isnan(outcome)
+    y = np.where(ok, outcome, 0.0)
+    pre = ok & ~post
+    after = ok & post
+    return np.column_stack([
+        np.bincount(codes, weights=pre, minlength=nvillages),
+        np.bincount(codes, weights=y * pre, minlength=nvillages),
+        np.bincount(codes, weights=after, minlength=nvillages),
+        np.bincount(codes, weights=y * after, minlength=nvillages),
+    ])
+
+
+def _tabular_did(Z, agg):
+    """Tabular DiD for every column of the (V, B) assignment matrix ``Z``."""
+    C = 1.0 - Z
+    n0, s0, n1, s1 = agg.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        treated = (s1 @ Z) / (n1 @ Z) - (s0 @ Z) / (n0 @ Z)
+        control = (s1 @ C) / (n1 @ C) - (s0 @ C) / (n0 @ C)
+    return treated - control
+
+
+def _regression_stats(design, codes, nvillages, treatment, time):
+    """Village aggregates for the FWL form of the regression DiD."""
+    names = design.names
+    drop = [names.index(treatment), names.index('%s:%s' % (treatment, time))]
+    W = np.delete(design.X, drop, axis=1)
+    y = design.y
+    t = design.X[:, names.index(time)]
+
+    wtw_inv = np.linalg.pinv(W.T @ W, hermitian=True)
+    y_res = y - W @ (wtw_inv @ (W.T @ y))
+    return {
+        'n': np.bincount(codes, minlength=nvillages).astype(np.float64),
+        'nt': np.bincount(codes, weights=t, minlength=nvillages),
+        'A1': group_sums(codes, W, nvillages).T,
+        'A2': group_sums(codes, W * t[:, None], nvillages).T,
+        'r1': np.bincount(codes, weights=y_res, minlength=nvillages),
+        'r2': np.bincount(codes, weights=y_res * t, minlength=nvillages),
+        'G': wtw_inv,
+    }
+
+
+def _regression_did(Z, agg):
+    """Interaction coefficient for every column of the assignment matrix."""
+    G = agg['G']
+    a1 = agg['A1'] @ Z
+    a2 = agg['A2'] @ Z
+    ga1 = G @ a1
+    m11 = agg['n'] @ Z - np.einsum('pb,pb->b', a1, ga1)
+    m22 = agg['nt'] @ Z - np.einsum('pb,pb->b', a2, G @ a2)
+    m12 = agg['nt'] @ Z - np.einsum('pb,pb->b', a2, ga1)
+    c1 = agg['r1'] @ Z
+    c2 = agg['r2'] @ Z
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (m11 * c2 - m12 * c1) / (m11 * m22 - m12 * m12)
+
+
+def _permuted_batch(rng, size, z, kind, agg):
+    Z = rng.permuted(np.repeat(z[:, None], size, axis=1), axis=0)
+    return _estimate(Z, kind, agg)
+
+
+def _estimate(Z, kind, agg):
+    return _regression_did(Z, agg) if kind == 'regression' else _tabular_did(Z, agg)
+
+
+def _all_assignments(nvillages, ntreated):
+    """Every assignment of ``ntreated`` of ``nvillages`` villages, (V, B)."""
+    combos = np.array(list(itertools.combinations(range(nvillages), ntreated)),
+                      dtype=np.intp).reshape(-1, ntreated)
+    Z = np.zeros((nvillages, len(combos)))
+    Z[combos, np.arange(len(combos))[:, None]] = 1.0
+    return Z
+
+
+def randomization_did(data, kind='tabular', outcome='sc', treatment='progresa',
+                      time='time', cluster='village', controls=(), subset=None,
+                      reps=9999, exact=None, seed=0, batch=500, n_jobs=None):
+    """Randomization-inference p-value for the DiD estimate.
+
+    Parameters
+    ----------
+    kind : {'tabular', 'regression'}
+        Tabular DiD of cell means, or the ``progresa:time`` coefficient of
+        ``outcome ~ treatment * time + controls``.
+    cluster : str
+        Unit of assignment; treatment must be constant within it.
+    exact : bool, optional
+        Enumerate every assignment. By default enumeration is used when
+        there are no more assignments than ``reps``, otherwise ``reps``
+        Monte Carlo draws are made in batches on a process pool.
+
+    Returns ``RandomizationResult(estimate, pvalue, null, exact)``; the
+    p-value is the two-sided share of null draws at least as extreme as
+    the observed estimate (the observed assignment is counted in the
+    Monte Carlo case).
+    """
+    if kind == 'regression':
+        rhs = ' + '.join(['%s * %s' % (treatment, time)] + list(controls))
+        design = build_design('%s ~ %s' % (outcome, rhs), data, subset=subset,
+                              extra=[cluster])
+        treat = design.X[:, design.names.index(treatment)]
+        codes, nvillages, z = _village_assignment(design.extras[cluster], treat)
+        agg = _regression_stats(design, codes, nvillages, treatment, time)
+    elif kind == 'tabular':
+        if subset:
+            data = data.query(subset)
+        codes, nvillages, z = _village_assignment(
+            data[cluster].to_numpy(), data[treatment].to_numpy(dtype=np.float64))
+        agg = _tabular_stats(codes, nvillages, data[outcome].to_numpy(dtype=np.float64),
+                             data[time].to_numpy() == 1)
+    else:
+        raise ValueError("kind must be 'tabular' or 'regression', got %r" % kind)
+
+    ntreated = int(z.sum())
+    estimate = float(_estimate(z[:, None], kind, agg)[0])
+    if exact is None:
+        exact = math.comb(nvillages, ntreated) <= reps
+    if exact:
+        null = _estimate(_all_assignments(nvillages, ntreated), kind, agg)
+        pvalue = np.mean(np.abs(null) >= abs(estimate) - 1e-12)
+    else:
+        null = map_batches(_permuted_batch, reps, args=(z, kind, agg),
+                           seed=seed, batch=batch, n_jobs=n_jobs)
+        pvalue = (1.0 + np.sum(np.abs(null) >= abs(estimate) - 1e-12)) / (reps + 1.0)
+    return RandomizationResult(estimate, float(pvalue), null, bool(exact))
@@ -0,0 +1,118 @@
+"""Out-of-core OLS for the statsmodels formula regressions.
+
+``fit_streaming`` evaluates a Patsy formula chunk by chunk, accumulating
+X'X, X'y, y'y and n, so memory is bounded by the chunk size rather than by
+the survey. Patsy's incremental builders make a first pass over the chunks
+to learn categorical levels and stateful transforms, so ``C(poor)`` or
+``progresa*time`` produce the same columns in every chunk; the second pass
+accumulates the cross-products. Columns the notebook derives rather than
+reads (``time``) are added to each chunk by a ``transform`` hook.
+"""
+
+import functools
+
+import numpy as np
+import pandas as pd
+import patsy
+
+from progresa.io import read_csv_chunks
+from progresa.ols import ols_from_moments
+
+
+def frame_chunks(data, chunksize=1000000):
+    """Zero-argument callable yielding row slices of an in-memory frame."""
+    def chunks():
+        for start in range(0, len(data), chunksize):
+            yield data.iloc[start:start + chunksize]
+    return chunks
+
+
+def as_chunk_source(source, chunksize=1000000):
+    """Turn a CSV path, a DataFrame or a callable into a chunk source.
+
+    A chunk source is a zero-argument callable returning a fresh iterable of
+    DataFrames each time it is called.
+    """
+    if isinstance(source, str):
+        return functools.partial(read_csv_chunks, source, chunksize)
+    if isinstance(source, pd.DataFrame):
+        return frame_chunks(source, chunksize)
+    if callable(source):
+        return source
+    raise TypeError('expected a CSV path, a DataFrame or a callable, got %r'
+                    % type(source).__name__)
+
+
+def add_time(chunk):
+    """Add the DiD ``time`` flag (1 in 1998), as the notebook does."""
+    if 'time' in chunk.columns or 'year' not in chunk.columns:
+        return chunk
+    return chunk.assign(time=(chunk['year'] == 98).astype('int8'))
+
+
+class CrossProducts(object):
+    """Running X'X, X'y, y'y, sum(y) and n for one design."""
+
+    def __init__(self, names):
+        k = len(names)
+        self.names = list(names)
+        self.xtx = np.zeros((k, k))
+        self.xty = np.zeros(k)
+        self.yty = 0.0
+        self.ysum = 0.0
+        self.nobs = 0
+
+    def update(self, y, X):
+        y = np.asarray(y, dtype=np.float64).ravel()
+        X = np.asarray(X, dtype=np.float64)
+        self.xtx += X.T @ X
+        self.xty += X.T @ y
+        self.yty += y @ y
+        self.ysum += y.sum()
+        self.nobs += len(y)
+
+    def fit(self):
+        return ols_from_moments(self.names, self.xtx, self.xty, self.yty,
+                                self.ysum, self.nobs,
+                                has_const='Intercept' in self.names)
+
+
+def fit_streaming(formula, source, subset=None, chunksize=1000000, transform=add_time):
+    """Fit ``formula`` by OLS over chunks of ``source``.
+
+    Parameters
+    ----------
+    formula : str
+        Patsy formula, as passed to ``statsmodels.formula.api.ols``.
+    source : str, DataFrame or callable
+        CSV path (read through the cache schema), in-memory frame, or a
+        zero-argument callable returning an iterable of chunks.
+    subset : str, optional
+        ``DataFrame.query`` expression applied to every chunk, e.g.
+        ``'poor == 1 and year == 98'``.
+    transform : callable, optional
+        Applied to every chunk before ``subset`` and Patsy, to add derived
+        columns. The default, ``add_time``, adds ``time = (year == 98)``
+        so ``progresa*time`` works on a CSV path with the same term names
+        as the in-memory fit; pass ``None`` to use the chunks as read.
+
+    Rows with missing values in any formula variable are dropped, as
+    ``ols(...).fit()`` does. Returns an ``OLSResults``.
+    """
+    chunks = as_chunk_source(source, chunksize)
+
+    def frames():
+        for chunk in chunks():
+            if transform is not None:
+                chunk = transform(chunk)
+            yield chunk.query(subset) if subset else chunk
+
+    y_info, x_info = patsy.incr_dbuilders(formula, frames)
+    acc = CrossProducts(x_info.column_names)
+    for chunk in frames():
+        if not len(chunk):
+            continue
+        y, X = patsy.build_design_matrices([y_info, x_info], chunk,
+                                           NA_action='drop')
+        acc.update(y, X)
+    return acc.fit()
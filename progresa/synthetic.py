@@ -0,0 +1,132 @@
+"""Synthetic panels with the schema of progresa_sample.csv.
+
+Children are nested in villages; treatment is assigned by village and the
+distance covariates are village-level, so clustering looks like the real
+survey. Every child is observed in 1997 and 1998, and ``sc`` rises in
+1998 for poor children in treated villages. Missing-value rates follow
+``MISSING_RATES``. ``scale`` multiplies the number of villages (and so of
+children) relative to the ~38,000-child sample.
+"""
+
+import numpy as np
+import pandas as pd
+
+BASE_VILLAGES = 505
+CHILDREN_PER_VILLAGE = 75
+TREATED_SHARE = 0.63
+POOR_SHARE = 0.85
+
+# Share of missing values per column, close to the sample's.
+MISSING_RATES = {
+    'sex': 0.0003,
+    'indig': 0.004,
+    'sc': 0.09,
+    'grc': 0.09,
+    'welfare_index': 0.003,
+    'hohsex': 0.0003,
+    'hohage': 0.0001,
+    'hohwag': 0.001,
+    'grc97': 0.05,
+    'sc97': 0.05,
+}
+
+COLUMNS = ['year', 'sex', 'indig', 'dist_sec', 'sc', 'grc', 'fam_n', 'min_dist',
+           'dist_cap', 'poor', 'progresa', 'hohedu', 'hohwag', 'welfare_index',
+           'hohsex', 'hohage', 'age', 'village', 'folnum', 'grc97', 'sc97']
+
+
+def _villages(rng, first_village, nvillages, first_child):
+    """Two waves for ``nvillages`` villages as one DataFrame."""
+    sizes = rng.poisson(CHILDREN_PER_VILLAGE, nvillages) + 1
+    n = sizes.sum()
+    village = np.repeat(np.arange(first_village, first_village + nvillages), sizes)
+    v = village - first_village
+
+    treated = rng.random(nvillages) < TREATED_SHARE
+    dist_sec = rng.gamma(2.0, 1.2, nvillages)
+    min_dist = np.clip(rng.normal(103, 42, nvillages), 5, None)
+    dist_cap = np.clip(rng.normal(148, 76, nvillages), 5, None)
+    village_effect = rng.normal(0, 0.4, nvillages)
+
+    poor = rng.random(n) < POOR_SHARE
+    hohedu = rng.poisson(np.where(poor, 2.5, 4.5))
+    welfare = np.where(poor, rng.normal(650, 90, n), rng.normal(850, 110, n))
+    base = {
+        'sex': (rng.random(n) < 0.51).astype(np.float64),
+        'indig': (rng.random(n) < 0.3).astype(np.float64),
+        'fam_n': rng.poisson(6.2, n) + 1,
+        'hohedu': hohedu,
+        'hohwag': np.round(rng.gamma(0.6, 980, n), 0),
+        'welfare_index': welfare,
+        'hohsex': (rng.random(n) < 0.925).astype(np.float64),
+        'hohage': np.clip(rng.normal(44, 11.6, n), 18, 95).round(),
+        'grc97': rng.integers(0, 10, n).astype(np.float64),
+    }
+    age97 = rng.integers(6, 17, n)
+    ability = rng.normal(0, 1, n)
+
+    frames = []
+    for wave, year in enumerate((97, 98)):
+        age = age97 + wave
+        effect = 0.35 * wave * (treated[v] & poor)
+        logit = (3.2 - 0.28 * (age - 6) + 0.08 * hohedu - 0.08 * dist_sec[v]
+                 + village_effect[v] + 0.6 * ability + 0.1 * wave + effect)
+        sc = (rng.random(n) < 1.0 / (1.0 + np.exp(-logit))).astype(np.float64)
+        if wave == 0:
+            sc97 = sc.copy()
+        frame = dict(base)
+        frame.update({
+            'year': year,
+            'dist_sec': dist_sec[v],
+            'min_dist': min_dist[v],
+            'dist_cap': dist_cap[v],
+            'sc': sc,
+            'grc': np.clip(age - 6 - rng.integers(0, 3, n), 0, None).astype(np.float64),
+            'poor': np.where(poor, 'pobre', 'no pobre'),
+            'progresa': np.where(treated[v], 'basal', '0'),
+            'age': age,
+            'village': village,
+            'folnum': np.arange(first_child, first_child + n),
+            'sc97': sc97,
+        })
+        frames.append(pd.DataFrame(frame, columns=COLUMNS))
+    panel = pd.concat(frames, ignore_index=True)
+    for name, rate in MISSING_RATES.items():
+        panel.loc[rng.random(len(panel)) < rate, name] = np.nan
+    return panel
+
+
+def iter_panel(scale=1.0, seed=0, villages_per_block=1000):
+    """Yield the synthetic panel in blocks of whole villages.
+
+    Each block has its own child of ``SeedSequence(seed)``, so the data
+    depend only on ``scale``, ``seed`` and ``villages_per_block``.
+    """
+    nvillages = max(int(round(BASE_VILLAGES * scale)), 2)
+    nblocks = -(-nvillages // villages_per_block)
+    seeds = np.random.SeedSequence(seed).spawn(nblocks)
+    first_child = 1
+    for b, block_seed in enumerate(seeds):
+        first = b * villages_per_block
+        count = min(villages_per_block, nvillages - first)
+        block = _villages(np.random.default_rng(block_seed), first + 1, count,
+                          first_child)
+        first_child = int(block['folnum'].max()) + 1
+        yield block
+
+
+def make_panel(scale=1.0, seed=0):
+    """The whole synthetic panel as one DataFrame (raw CSV labels)."""
+    return pd.concat(iter_panel(scale, seed), ignore_index=True)
+
+
+def write_csv(path, scale=1.0, seed=0):
+    """Write a synthetic ``progresa_sample.csv``-shaped file block by block.
+
+    Memory use is bounded by one block of villages whatever the scale.
+    """
+    rows = 0
+    for b, block in enumerate(iter_panel(scale, seed)):
+        block.to_csv(path, mode='w' if b == 0 else 'a', header=(b == 0), index=False)
+        rows += len(block)
+    return rows